@@ -1,6 +1,17 @@
 from django.contrib import admin
 
-from .models import Block, Document, Insight, InsightEvent, SentimentSnapshot, Space, StreakState, WritingSession
+from .models import (
+    Block,
+    Document,
+    Insight,
+    InsightEvent,
+    InsightEventRollup,
+    SentimentRollup,
+    SentimentSnapshot,
+    Space,
+    StreakState,
+    WritingSession,
+)
 
 
 admin.site.register(Space)
@@ -9,5 +20,7 @@ admin.site.register(Block)
 admin.site.register(WritingSession)
 admin.site.register(Insight)
 admin.site.register(InsightEvent)
+admin.site.register(InsightEventRollup)
 admin.site.register(SentimentSnapshot)
+admin.site.register(SentimentRollup)
 admin.site.register(StreakState)
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .services import clear_lexicon
+
+        # Term ids change when the vocabulary is flushed or re-seeded.
+        post_migrate.connect(clear_lexicon, sender=self)
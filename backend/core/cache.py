@@ -0,0 +1,290 @@
+"""Bounded in-process cache of per-space candidate features for insight scoring."""
+
+from __future__ import annotations
+
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import Any, NamedTuple
+
+from django.conf import settings
+
+from .feature_store import FeatureFile, open_feature_file, space_path, version_digest, write_feature_file
+from .models import Block, Document, Space
+
+
+class CandidateFeatures(NamedTuple):
+    """Scoring features of a historical block, shaped like the `Block` attributes the scorer reads."""
+
+    id: int
+    document_id: int
+    token_array: array
+    token_count: int
+    sentiment_score: float
+    is_foundational: bool
+    created_at: datetime
+    updated_at: datetime
+    content_hash: str
+
+
+class SpaceCandidates:
+    """Candidate features for one (user, space), most recent first, with an in-memory token index."""
+
+    def __init__(self, version: Any, candidates: list[CandidateFeatures]):
+        self.version = version
+        self.document_versions: dict[int, int] = {}
+        self.candidates = candidates
+        self.size = sum(candidate.token_count for candidate in candidates) + len(candidates)
+        self.postings: dict[int, list[int]] = {}
+        for position, candidate in enumerate(candidates):
+            for token in candidate.token_array:
+                self.postings.setdefault(token, []).append(position)
+
+    def matching(
+        self, tokens: set[int], exclude_document_id: int | None, since: datetime | None = None
+    ) -> list[CandidateFeatures]:
+        """Return candidates sharing a term id with `tokens`, keeping recency order."""
+        positions: set[int] = set()
+        for token in tokens:
+            positions.update(self.postings.get(token, ()))
+        matches = []
+        for position in sorted(positions):
+            candidate = self.candidates[position]
+            if candidate.document_id == exclude_document_id:
+                continue
+            if since and candidate.updated_at <= since:
+                continue
+            matches.append(candidate)
+        return matches
+
+
+class MappedSpaceCandidates:
+    """Candidate features for one (user, space) read in place from a memory-mapped feature file.
+
+    Only the rows a lookup matches are copied out, so every worker process shares the
+    file's page-cache pages instead of holding its own copy of the space.
+    """
+
+    def __init__(self, version: Any, features: FeatureFile):
+        self.version = version
+        self.document_versions: dict[int, int] = {}
+        self.features = features
+        self.size = features.token_slots + features.rows
+
+    def matching(
+        self, tokens: set[int], exclude_document_id: int | None, since: datetime | None = None
+    ) -> list[CandidateFeatures]:
+        """Return candidates sharing a term id with `tokens`, keeping recency order."""
+        features = self.features
+        since_micros = _micros(since) if since else None
+        matches = []
+        for position in sorted(features.positions_for(tokens)):
+            if features.document_ids[position] == exclude_document_id:
+                continue
+            if since_micros is not None and features.updated[position] <= since_micros:
+                continue
+            token_array = features.token_array(position)
+            matches.append(
+                CandidateFeatures(
+                    features.ids[position],
+                    features.document_ids[position],
+                    token_array,
+                    len(token_array),
+                    features.sentiments[position],
+                    bool(features.foundational[position]),
+                    _from_micros(features.created[position]),
+                    _from_micros(features.updated[position]),
+                    features.content_hash(position),
+                )
+            )
+        return matches
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _micros(moment: datetime) -> int:
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _space_rows(user_id: int, space_id: int) -> list[tuple]:
+    return list(
+        Block.objects.filter(user_id=user_id, space_id=space_id, token_count__gt=0)
+        .order_by("-created_at", "-id")
+        .values_list(
+            "id",
+            "document_id",
+            "token_ids",
+            "token_count",
+            "sentiment_score",
+            "is_foundational",
+            "created_at",
+            "updated_at",
+            "content_hash",
+        )
+    )
+
+
+def _in_memory_candidates(version: Any, rows: list[tuple]) -> SpaceCandidates:
+    candidates = []
+    for block_id, document_id, token_ids, *rest in rows:
+        token_array = array("I")
+        token_array.frombytes(bytes(token_ids))
+        candidates.append(CandidateFeatures(block_id, document_id, token_array, *rest))
+    return SpaceCandidates(version, candidates)
+
+
+def load_space_candidates(user_id: int, space_id: int, version: Any) -> SpaceCandidates | MappedSpaceCandidates:
+    """Materialize the stored features of every scorable block in a space.
+
+    With `MARS_FEATURE_STORE_DIR` set, features come from the space's feature file, which
+    the first process to see a new space version rewrites from the database.
+    """
+    path = space_path(user_id, space_id)
+    if path is None:
+        return _in_memory_candidates(version, _space_rows(user_id, space_id))
+
+    digest = version_digest(version)
+    features = open_feature_file(path, digest)
+    if features is None:
+        rows = _space_rows(user_id, space_id)
+        write_feature_file(
+            path,
+            digest,
+            (
+                (
+                    block_id,
+                    document_id,
+                    token_ids,
+                    sentiment,
+                    foundational,
+                    _micros(created_at),
+                    _micros(updated_at),
+                    content_hash,
+                )
+                for block_id, document_id, token_ids, _, sentiment, foundational, created_at, updated_at, content_hash in rows
+            ),
+        )
+        features = open_feature_file(path, digest)
+        if features is None:
+            # Another process already replaced the file for a newer version.
+            return _in_memory_candidates(version, rows)
+    return MappedSpaceCandidates(version, features)
+
+
+def space_versions(space_id: int) -> tuple[Any, dict[int, int]]:
+    """Read a space's (created_at, blocks_version) and each of its documents' blocks_version at once."""
+    rows = list(
+        Document.objects.filter(space_id=space_id).values_list(
+            "id", "blocks_version", "space__created_at", "space__blocks_version"
+        )
+    )
+    if not rows:
+        return Space.objects.filter(id=space_id).values_list("created_at", "blocks_version").first(), {}
+    return (rows[0][2], rows[0][3]), {document_id: version for document_id, version, *_ in rows}
+
+
+def _current_for(
+    entry: SpaceCandidates | MappedSpaceCandidates, version: Any, document_id: int | None, document_version: int
+) -> bool:
+    """Return whether no document but `document_id` has changed blocks since `entry` was loaded."""
+    created_at, space_version = version
+    loaded_at, loaded_version = entry.version
+    return created_at == loaded_at and (
+        space_version - document_version == loaded_version - entry.document_versions.get(document_id, 0)
+    )
+
+
+class CandidateCache:
+    """LRU of space candidates keyed by (user, space), bounded by total cached token slots.
+
+    Entries are validated on every lookup against the space's `blocks_version` counter (with
+    its creation time), less the caller's own document's counter. A save in any worker
+    process thus invalidates stale copies held by the others, except for the saving
+    document, whose candidates its own lookups exclude anyway.
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple[int, int], SpaceCandidates | MappedSpaceCandidates] = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def max_size() -> int:
+        return getattr(settings, "MARS_CANDIDATE_CACHE_MAX_TOKENS", 2_000_000)
+
+    def lookup(
+        self,
+        user_id: int,
+        space_id: int,
+        version: Any,
+        document_id: int | None = None,
+        document_version: int = 0,
+        load: bool = True,
+    ) -> SpaceCandidates | MappedSpaceCandidates | None:
+        """Return current features for a space as seen from `document_id`, loading them on a miss.
+
+        Returns None on a miss without `load`, or when the space alone would exceed the cache
+        budget, so callers fall back to database retrieval.
+        """
+        key = (user_id, space_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and _current_for(entry, version, document_id, document_version):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if not load:
+            return None
+
+        version, document_versions = space_versions(space_id)
+        if version is None:
+            return None
+        entry = load_space_candidates(user_id, space_id, version)
+        entry.document_versions = document_versions
+        limit = self.max_size()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            if entry.size > limit:
+                return None
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > limit:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self.evictions += 1
+        return entry
+
+    def stats(self) -> dict[str, int]:
+        """Expose hit/miss counters and current occupancy."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spaces": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size(),
+            }
+
+    def clear(self) -> None:
+        """Drop every entry and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+candidate_cache = CandidateCache()
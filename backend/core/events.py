@@ -0,0 +1,248 @@
+"""Bulk insight event ingestion, an optional in-process write-behind buffer, and monthly event compaction."""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Any, Collection, Sequence
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .funnel import count_events
+from .models import Insight, InsightEvent, InsightEventRollup, WritingSession
+
+logger = logging.getLogger(__name__)
+
+
+def _insight_keys(items: Sequence[dict[str, Any]]) -> dict[int, tuple[int, str, str]]:
+    """Map the existing insight ids among `items` to their (space id, relation type, mode) in one query."""
+    rows = Insight.objects.filter(id__in={item["insight_id"] for item in items}).values_list(
+        "id", "session__space_id", "relation_type", "session__mode"
+    )
+    return {insight_id: (space_id, relation_type, mode) for insight_id, space_id, relation_type, mode in rows}
+
+
+def _build(items: Sequence[dict[str, Any]], known: Collection[int]) -> tuple[list[InsightEvent], list[int]]:
+    session_ids = {item["session_id"] for item in items if item.get("session_id")}
+    sessions: set[int] = set()
+    if session_ids:
+        sessions = set(WritingSession.objects.filter(id__in=session_ids).values_list("id", flat=True))
+    events: list[InsightEvent] = []
+    rejected: list[int] = []
+    for item in items:
+        if item["insight_id"] not in known:
+            rejected.append(item["insight_id"])
+            continue
+        events.append(
+            InsightEvent(
+                insight_id=item["insight_id"],
+                session_id=item.get("session_id") if item.get("session_id") in sessions else None,
+                event_type=item["event_type"],
+                metadata=item.get("metadata") or {},
+            )
+        )
+    return events, rejected
+
+
+def build_insight_events(items: Sequence[dict[str, Any]]) -> tuple[list[InsightEvent], list[int]]:
+    """Turn validated event payloads into unsaved events, checking insight and session ids in bulk.
+
+    Returns the events and the insight ids that no longer exist. Unknown session ids are
+    dropped to null, like the single-event endpoint does.
+    """
+    return _build(items, _insight_keys(items))
+
+
+def record_insight_events(items: Sequence[dict[str, Any]]) -> tuple[list[InsightEvent], list[int]]:
+    """Insert a batch of events and count them into the funnel in one transaction.
+
+    Returns the created events and the rejected insight ids.
+    """
+    keys = _insight_keys(items)
+    events, rejected = _build(items, keys)
+    with transaction.atomic():
+        InsightEvent.objects.bulk_create(events, batch_size=500)
+        count_events((*keys[event.insight_id], event.event_type) for event in events)
+    return events, rejected
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _partition_bounds(month: date) -> tuple[datetime, datetime]:
+    """Return the created_at range of the monthly event partition starting on `month`."""
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(month, time.min, tzinfo=tz),
+        datetime.combine(next_month(month), time.min, tzinfo=tz),
+    )
+
+
+def retention_cutoff(months: int | None = None, today: date | None = None) -> date:
+    """Return the oldest month kept raw: `months` (default `MARS_INSIGHT_EVENT_RETENTION_MONTHS`) before this one."""
+    if months is None:
+        months = getattr(settings, "MARS_INSIGHT_EVENT_RETENTION_MONTHS", 6)
+    month = month_start(today or timezone.localdate())
+    for _ in range(months):
+        month = (month - timedelta(days=1)).replace(day=1)
+    return month
+
+
+def enable_incremental_vacuum() -> bool:
+    """Switch a SQLite database to incremental auto-vacuum; returns whether it was switched now.
+
+    The switch needs a full VACUUM, which rewrites and exclusively locks the whole file, so
+    it is an explicit one-off step to run in a maintenance window, outside a transaction.
+    """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] == 2:  # INCREMENTAL
+            return False
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    return True
+
+
+def reclaim_event_space() -> int:
+    """Release pages freed by deleted events; returns the number of SQLite pages given back.
+
+    Monthly partitions are logical (created_at ranges of one table), so dropping a month
+    only frees pages inside the database. SQLite files are truncated by that much once
+    `enable_incremental_vacuum` has run (otherwise nothing happens); PostgreSQL tables are
+    vacuumed outside a transaction so the pages are reused.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:  # INCREMENTAL
+                return 0
+            cursor.execute("PRAGMA freelist_count")
+            free = cursor.fetchone()[0]
+            # The sqlite3 module steps a row-less PRAGMA once, which frees a single page.
+            for _ in range(free):
+                cursor.execute("PRAGMA incremental_vacuum")
+            cursor.execute("PRAGMA freelist_count")
+            return free - cursor.fetchone()[0]
+        if connection.vendor == "postgresql" and not connection.in_atomic_block:
+            cursor.execute(f"VACUUM {connection.ops.quote_name(InsightEvent._meta.db_table)}")
+    return 0
+
+
+def compact_insight_events(before: date) -> tuple[int, int]:
+    """Fold raw events of every monthly partition before `before` into per-insight rollups and drop them.
+
+    Each partition is compacted in its own transaction. Funnel counters were already
+    updated when the events were recorded, so they are left alone. Returns the number of
+    partitions compacted and raw events deleted.
+    """
+    oldest = InsightEvent.objects.order_by("created_at").values_list("created_at", flat=True).first()
+    if oldest is None:
+        return 0, 0
+    partitions = deleted = 0
+    month = month_start(timezone.localtime(oldest).date())
+    while month < before:
+        start, end = _partition_bounds(month)
+        with transaction.atomic():
+            raw = InsightEvent.objects.filter(created_at__gte=start, created_at__lt=end)
+            counts = {
+                (row["insight_id"], row["event_type"]): row["events"]
+                for row in raw.values("insight_id", "event_type").annotate(events=Count("id")).order_by()
+            }
+            existing = {
+                (rollup.insight_id, rollup.event_type): rollup
+                for rollup in InsightEventRollup.objects.filter(month=month, insight_id__in={key[0] for key in counts})
+            }
+            created = []
+            for (insight_id, event_type), events in counts.items():
+                rollup = existing.get((insight_id, event_type))
+                if rollup is None:
+                    created.append(
+                        InsightEventRollup(insight_id=insight_id, month=month, event_type=event_type, count=events)
+                    )
+                else:
+                    rollup.count += events
+            InsightEventRollup.objects.bulk_create(created, batch_size=500)
+            InsightEventRollup.objects.bulk_update(existing.values(), ["count"], batch_size=500)
+            deleted += raw.delete()[0]
+        partitions += 1
+        month = next_month(month)
+    return partitions, deleted
+
+
+def event_buffer_enabled() -> bool:
+    return getattr(settings, "MARS_INSIGHT_EVENT_BUFFER_ENABLED", False)
+
+
+class EventBuffer:
+    """Process-local write-behind queue of insight events, flushed in bulk.
+
+    A flush happens once `MARS_INSIGHT_EVENT_BUFFER_SIZE` events are waiting, or
+    `MARS_INSIGHT_EVENT_FLUSH_SECONDS` after the first event entered an empty buffer, and
+    at interpreter exit. Insight ids are re-checked at flush time, so events for insights
+    deleted meanwhile are dropped. Events of a process that dies before flushing are lost.
+    """
+
+    def __init__(self):
+        self._pending: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    @staticmethod
+    def max_events() -> int:
+        return getattr(settings, "MARS_INSIGHT_EVENT_BUFFER_SIZE", 200)
+
+    @staticmethod
+    def max_seconds() -> float:
+        return getattr(settings, "MARS_INSIGHT_EVENT_FLUSH_SECONDS", 2.0)
+
+    def add(self, items: Sequence[dict[str, Any]]) -> None:
+        """Queue validated event payloads, flushing inline when the size threshold is reached."""
+        with self._lock:
+            self._pending.extend(items)
+            full = len(self._pending) >= self.max_events()
+            if not full and self._timer is None and self._pending:
+                self._timer = threading.Timer(self.max_seconds(), self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Insert every queued event now; returns how many were written."""
+        with self._lock:
+            items, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not items:
+            return 0
+        events, _ = record_insight_events(items)
+        return len(events)
+
+    def _flush_on_timer(self) -> None:
+        try:
+            self.flush()
+        except Exception:  # noqa: BLE001 - nothing above the timer thread would report it
+            logger.exception("Insight event flush failed")
+        finally:
+            connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+event_buffer = EventBuffer()
+atexit.register(event_buffer.flush)
@@ -0,0 +1,170 @@
+"""Columnar per-space feature files, memory-mapped so worker processes share one page-cache copy."""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Any, Iterable
+
+from django.conf import settings
+
+MAGIC = b"MARSFEAT"
+FORMAT_VERSION = 2
+# magic, format version, space version digest, rows, token slots, distinct terms
+HASH_BYTES = 32
+_HEADER = struct.Struct("=8sI4x16sQQQ")
+
+
+def feature_store_dir() -> Path | None:
+    """Return the feature store directory, or None when the store is disabled."""
+    directory = getattr(settings, "MARS_FEATURE_STORE_DIR", None)
+    return Path(directory) if directory else None
+
+
+def version_digest(version: Any) -> bytes:
+    """Fingerprint a space version so a file written for an older version is never read."""
+    return hashlib.blake2b(repr(version).encode("utf-8"), digest_size=16).digest()
+
+
+def space_path(user_id: int, space_id: int) -> Path | None:
+    directory = feature_store_dir()
+    return directory / f"{user_id}-{space_id}.features" if directory else None
+
+
+def write_feature_file(
+    path: Path, digest: bytes, rows: Iterable[tuple[int, int, bytes, float, bool, int, int, str]]
+) -> None:
+    """Write a space's rows as columns, replacing any previous file atomically.
+
+    Rows are (block id, document id, term id bytes, sentiment, foundational, created and
+    updated timestamps in microseconds, content hash) in recency order. Alongside the row columns the
+    file holds a term -> row positions index. The file is written to a temporary name in
+    the same directory and renamed over the old one, so readers either keep their mapping
+    of the previous file or open the complete new one.
+    """
+    ids, document_ids, offsets, sentiments = array("q"), array("q"), array("q", [0]), array("d")
+    created, updated, foundational, tokens = array("q"), array("q"), array("B"), array("I")
+    content_hashes = array("B")
+    postings: dict[int, list[int]] = {}
+    for position, row in enumerate(rows):
+        block_id, document_id, token_ids, sentiment, is_foundational, created_us, updated_us, content_hash = row
+        row_tokens = array("I")
+        row_tokens.frombytes(bytes(token_ids))
+        for token in row_tokens:
+            postings.setdefault(token, []).append(position)
+        tokens.extend(row_tokens)
+        ids.append(block_id)
+        document_ids.append(document_id)
+        offsets.append(len(tokens))
+        sentiments.append(sentiment)
+        foundational.append(int(is_foundational))
+        created.append(created_us)
+        updated.append(updated_us)
+        content_hashes.frombytes(bytes.fromhex(content_hash) if content_hash else bytes(HASH_BYTES))
+
+    terms = array("I", sorted(postings))
+    term_offsets, positions = array("q", [0]), array("I")
+    for term in terms:
+        positions.extend(postings[term])
+        term_offsets.append(len(positions))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(descriptor, "wb") as handle:
+            handle.write(_HEADER.pack(MAGIC, FORMAT_VERSION, digest, len(ids), len(tokens), len(terms)))
+            # 8-byte columns first, then 4-byte, then 1-byte, so every column stays aligned.
+            for column in (
+                ids,
+                document_ids,
+                offsets,
+                sentiments,
+                created,
+                updated,
+                term_offsets,
+                tokens,
+                terms,
+                positions,
+                foundational,
+                content_hashes,
+            ):
+                handle.write(column)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+class FeatureFile:
+    """Read-only columns of a space feature file, viewed in place over a shared memory map."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, self.digest, self.rows, token_slots, term_count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a feature file")
+
+        view = memoryview(self._map)
+        offset = _HEADER.size
+
+        def column(typecode: str, length: int) -> memoryview:
+            nonlocal offset
+            end = offset + array(typecode).itemsize * length
+            if end > len(view):
+                raise ValueError(f"{path} is truncated")
+            values = view[offset:end].cast(typecode)
+            offset = end
+            return values
+
+        rows = self.rows
+        self.ids = column("q", rows)
+        self.document_ids = column("q", rows)
+        self.offsets = column("q", rows + 1)
+        self.sentiments = column("d", rows)
+        self.created = column("q", rows)
+        self.updated = column("q", rows)
+        self.term_offsets = column("q", term_count + 1)
+        self.tokens = column("I", token_slots)
+        self.terms = column("I", term_count)
+        self.positions = column("I", token_slots)
+        self.foundational = column("B", rows)
+        self.content_hashes = column("B", rows * HASH_BYTES)
+        self.token_slots = token_slots
+
+    def positions_for(self, tokens: Iterable[int]) -> set[int]:
+        """Return row positions of every row containing one of `tokens`."""
+        found: set[int] = set()
+        for token in tokens:
+            index = bisect.bisect_left(self.terms, token)
+            if index < len(self.terms) and self.terms[index] == token:
+                found.update(self.positions[self.term_offsets[index] : self.term_offsets[index + 1]])
+        return found
+
+    def token_array(self, position: int) -> array:
+        """Copy one row's term ids out of the mapping."""
+        ids = array("I")
+        ids.frombytes(self.tokens[self.offsets[position] : self.offsets[position + 1]].cast("B"))
+        return ids
+
+    def content_hash(self, position: int) -> str:
+        """Return one row's SHA-256 content hash as hex ("" for rows stored without one)."""
+        digest = bytes(self.content_hashes[position * HASH_BYTES : (position + 1) * HASH_BYTES])
+        return digest.hex() if any(digest) else ""
+
+
+def open_feature_file(path: Path, digest: bytes) -> FeatureFile | None:
+    """Map the file at `path` if it exists and was written for the space version `digest`."""
+    try:
+        features = FeatureFile(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+    return features if features.digest == digest else None
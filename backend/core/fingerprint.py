@@ -0,0 +1,115 @@
+"""Document-level Bloom filter fingerprints used to prune candidate documents before block scoring."""
+
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+from typing import Iterable, Sequence
+
+from django.conf import settings
+
+from .scoring import MIN_OVERLAP
+
+FINGERPRINT_HASHES = 3
+_MASK64 = (1 << 64) - 1
+
+
+def fingerprint_bits() -> int:
+    """Return the configured fingerprint width for newly built fingerprints."""
+    return getattr(settings, "MARS_DOCUMENT_FINGERPRINT_BITS", 8192)
+
+
+def _mix(term_id: int) -> int:
+    """Scramble a term id into 64 well-mixed bits (the splitmix64 finalizer)."""
+    z = (term_id + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _positions(term_id: int, bits: int) -> list[int]:
+    """Derive the filter positions of a term by double hashing both halves of its mixed id."""
+    mixed = _mix(term_id)
+    low, high = mixed & 0xFFFFFFFF, (mixed >> 32) | 1
+    return [(low + i * high) % bits for i in range(FINGERPRINT_HASHES)]
+
+
+def document_fingerprint(
+    token_arrays: Iterable[Sequence[int]], bits: int | None = None, base: bytes = b""
+) -> bytes:
+    """Build a Bloom filter over the union of term ids of a document's blocks, or add them to `base`."""
+    filter_bytes = bytearray(base) if base else bytearray((bits or fingerprint_bits()) // 8)
+    width = len(filter_bytes) * 8
+    for token_array in token_arrays:
+        for term_id in token_array:
+            for position in _positions(term_id, width):
+                filter_bytes[position >> 3] |= 1 << (position & 7)
+    return bytes(filter_bytes)
+
+
+@lru_cache(maxsize=1 << 16)
+def _term_mask(term_id: int, bits: int) -> int:
+    """Return the filter bits of a term as an integer mask; cached across documents and runs."""
+    mask = 0
+    for position in _positions(term_id, bits):
+        mask |= 1 << position
+    return mask
+
+
+def possible_shared_terms(fingerprint: bytes, token_array: Sequence[int]) -> int:
+    """Count terms that may occur in the fingerprinted document; never undercounts."""
+    width = len(fingerprint) * 8
+    bits = int.from_bytes(fingerprint, "little")
+    return sum(1 for term_id in token_array if bits & (mask := _term_mask(term_id, width)) == mask)
+
+
+class FingerprintQuery:
+    """The current blocks of one retrieval, tested against the fingerprints of many documents.
+
+    Term masks are built once per filter width, so each document costs one pass of integer
+    ANDs, and a block is given up as soon as it has missed too many terms to qualify.
+    """
+
+    def __init__(self, token_arrays: Sequence[Sequence[int]]):
+        self.token_arrays = [token_array for token_array in token_arrays if token_array]
+        self._masks: dict[int, list[tuple[int, list[int]]]] = {}
+
+    def _masks_for(self, width: int) -> list[tuple[int, list[int]]]:
+        masks = self._masks.get(width)
+        if masks is None:
+            # Jaccard(C, B) >= t needs at least ceil(t * |C|) shared terms, so more misses rule C out.
+            masks = self._masks[width] = [
+                (
+                    len(token_array) - math.ceil(MIN_OVERLAP * len(token_array)),
+                    [_term_mask(term_id, width) for term_id in token_array],
+                )
+                for token_array in self.token_arrays
+            ]
+        return masks
+
+    def can_reach(self, fingerprint: bytes) -> bool:
+        """Return whether any block of the document could reach `MIN_OVERLAP` with one of the current blocks.
+
+        Jaccard(C, B) >= t implies |C & B| >= t * |C|, and |C & B| is bounded by how many of C's
+        terms the document contains, which the Bloom filter over-estimates. A document whose
+        fingerprint falls short for every current block cannot produce an insight. An empty
+        fingerprint (not built yet) is never pruned.
+        """
+        if not fingerprint:
+            return True
+        bits = int.from_bytes(fingerprint, "little")
+        for allowed_misses, masks in self._masks_for(len(fingerprint) * 8):
+            misses = 0
+            for mask in masks:
+                if bits & mask != mask:
+                    misses += 1
+                    if misses > allowed_misses:
+                        break
+            else:
+                return True
+        return False
+
+
+def can_reach_overlap(fingerprint: bytes, token_arrays: Sequence[Sequence[int]]) -> bool:
+    """Return whether any block of the document could reach `MIN_OVERLAP`; see `FingerprintQuery.can_reach`."""
+    return FingerprintQuery(token_arrays).can_reach(fingerprint)
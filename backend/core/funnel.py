@@ -0,0 +1,115 @@
+"""Insight funnel counters maintained as events are recorded, and constant-size funnel reads."""
+
+from __future__ import annotations
+
+from collections import Counter
+from datetime import date, timedelta
+from typing import Any, Iterable
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import InsightEvent, InsightEventRollup, InsightEventType, InsightFunnelCounter
+
+# Event type -> counter column.
+FUNNEL_STAGES = {
+    InsightEventType.INSIGHT_SHOWN: "shown",
+    InsightEventType.INSIGHT_OPENED: "opened",
+    InsightEventType.INSIGHT_MARKED_USEFUL: "useful",
+    InsightEventType.INSIGHT_DISMISSED: "dismissed",
+}
+STAGE_FIELDS = tuple(FUNNEL_STAGES.values())
+
+
+def count_events(events: Iterable[tuple[int, str, str, str]], day: date | None = None) -> None:
+    """Add (space id, relation type, mode, event type) events recorded on `day` (default today) to the counters."""
+    day = day or timezone.localdate()
+    increments: dict[tuple[int, str, str], Counter[str]] = {}
+    for space_id, relation_type, mode, event_type in events:
+        increments.setdefault((space_id, relation_type, mode), Counter())[FUNNEL_STAGES[event_type]] += 1
+    for (space_id, relation_type, mode), counts in increments.items():
+        key = {"space_id": space_id, "relation_type": relation_type, "mode": mode, "day": day}
+        while not InsightFunnelCounter.objects.filter(**key).update(
+            **{field: F(field) + amount for field, amount in counts.items()}
+        ):
+            try:
+                with transaction.atomic():
+                    InsightFunnelCounter.objects.create(**key, **counts)
+                break
+            except IntegrityError:
+                continue  # another writer created the row first; add to it
+
+
+def _rates(counts: dict[str, int]) -> dict[str, Any]:
+    shown, opened = counts["shown"], counts["opened"]
+    return {
+        **counts,
+        "open_rate": round(opened / shown, 4) if shown else None,
+        "useful_rate": round(counts["useful"] / opened, 4) if opened else None,
+        "dismiss_rate": round(counts["dismissed"] / shown, 4) if shown else None,
+    }
+
+
+def insight_funnel(
+    user_id: int,
+    start: date,
+    end: date,
+    space_id: int | None = None,
+    mode: str | None = None,
+    relation_type: str | None = None,
+) -> dict[str, Any]:
+    """Sum counters over a day range into overall and per relation type funnels with stage rates.
+
+    Reads at most one row per day, space, relation type and mode in range, however many
+    events were recorded.
+    """
+    rows = InsightFunnelCounter.objects.filter(space__user_id=user_id, day__gte=start, day__lte=end)
+    if space_id is not None:
+        rows = rows.filter(space_id=space_id)
+    if mode:
+        rows = rows.filter(mode=mode)
+    if relation_type:
+        rows = rows.filter(relation_type=relation_type)
+    sums = {field: Sum(field) for field in STAGE_FIELDS}
+    totals = {field: value or 0 for field, value in rows.aggregate(**sums).items()}
+    by_relation = {
+        row.pop("relation_type"): _rates(row)
+        for row in rows.values("relation_type").annotate(**sums).order_by("relation_type")
+    }
+    return {"totals": _rates(totals), "by_relation_type": by_relation}
+
+
+def rebuild_funnel_counters() -> int:
+    """Recompute counters from the stored events; returns the number of counter rows rebuilt.
+
+    Days in months already compacted into `InsightEventRollup` have no raw events left, so
+    their counters are kept as they are.
+    """
+    compacted = InsightEventRollup.objects.aggregate(latest=Max("month"))["latest"]
+    since = (compacted.replace(day=28) + timedelta(days=4)).replace(day=1) if compacted else None
+    counters: dict[tuple[int, str, str, date], InsightFunnelCounter] = {}
+    grouped = (
+        InsightEvent.objects.annotate(day=TruncDate("created_at"))
+        .values("insight__session__space_id", "insight__relation_type", "insight__session__mode", "day", "event_type")
+        .annotate(events=Count("id"))
+        .order_by()
+    )
+    stale = InsightFunnelCounter.objects.all()
+    if since:
+        grouped = grouped.filter(day__gte=since)
+        stale = stale.filter(day__gte=since)
+    for row in grouped:
+        key = (row["insight__session__space_id"], row["insight__relation_type"], row["insight__session__mode"], row["day"])
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = InsightFunnelCounter(
+                space_id=key[0], relation_type=key[1], mode=key[2], day=key[3]
+            )
+        field = FUNNEL_STAGES[row["event_type"]]
+        setattr(counter, field, getattr(counter, field) + row["events"])
+    with transaction.atomic():
+        stale.delete()
+        InsightFunnelCounter.objects.bulk_create(counters.values(), batch_size=500)
+    return len(counters)
@@ -0,0 +1,167 @@
+"""Database-backed insight generation queue processed outside the request path.
+
+Each session has at most one pending and one running job, enforced by partial unique
+indexes so the guarantee holds across worker processes. Callers that queue work while
+a job is pending share that job, and work queued during a run becomes a single trailing
+run that starts once the current one finishes.
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Collection
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Insight, InsightJob, InsightJobStatus, WritingSession
+from .services import generate_insights_for_session
+
+logger = logging.getLogger(__name__)
+
+
+def jobs_eager() -> bool:
+    return getattr(settings, "MARS_INSIGHT_JOBS_EAGER", False)
+
+
+def enqueue_insight_job(session: WritingSession) -> InsightJob:
+    """Queue insight generation for a session, joining its pending job if one is already waiting."""
+    while True:
+        job = InsightJob.objects.filter(session=session, status=InsightJobStatus.PENDING).first()
+        if job is not None:
+            break
+        try:
+            with transaction.atomic():
+                job = InsightJob.objects.create(session=session)
+            break
+        except IntegrityError:
+            continue  # another caller queued one first; share it
+    if jobs_eager():
+        run_session_jobs(session.id)
+        job.refresh_from_db()
+    return job
+
+
+def _claim(job_id: int) -> bool:
+    """Atomically move a pending job to running; fails while another run of its session is in flight."""
+    try:
+        with transaction.atomic():
+            return bool(
+                InsightJob.objects.filter(id=job_id, status=InsightJobStatus.PENDING).update(
+                    status=InsightJobStatus.RUNNING, started_at=timezone.now()
+                )
+            )
+    except IntegrityError:
+        return False
+
+
+def expire_stale_jobs() -> int:
+    """Fail running jobs older than `MARS_INSIGHT_JOB_TIMEOUT_SECONDS`, freeing their session for new runs."""
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, "MARS_INSIGHT_JOB_TIMEOUT_SECONDS", 300))
+    return InsightJob.objects.filter(status=InsightJobStatus.RUNNING, started_at__lt=cutoff).update(
+        status=InsightJobStatus.FAILED, error="timed out", finished_at=now
+    )
+
+
+def claim_next_job() -> InsightJob | None:
+    """Claim the oldest pending job of a session with no run in flight, or return None."""
+    expire_stale_jobs()
+    while True:
+        job_id = (
+            InsightJob.objects.filter(status=InsightJobStatus.PENDING)
+            .exclude(session__insight_jobs__status=InsightJobStatus.RUNNING)
+            .order_by("created_at", "id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        if _claim(job_id):
+            return InsightJob.objects.select_related("session").get(id=job_id)
+
+
+def _run(job: InsightJob) -> list[Insight]:
+    """Generate insights for a running job and record the outcome on it.
+
+    Queued runs are off the typing path and nothing would redo a partial one, so they
+    ignore `MARS_INSIGHT_TIME_BUDGET_SECONDS` and always score every block.
+    """
+    try:
+        insights = generate_insights_for_session(job.session, time_budget=0)
+    except Exception as exc:
+        job.status = InsightJobStatus.FAILED
+        job.error = str(exc)
+        raise
+    else:
+        job.status = InsightJobStatus.DONE
+        job.insight_count = len(insights)
+        job.partial = job.session.insights_partial
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "insight_count", "partial", "error", "finished_at"])
+    return insights
+
+
+def run_insight_job(job: InsightJob) -> InsightJob:
+    """Generate insights for a claimed job and record the outcome on it."""
+    try:
+        _run(job)
+    except Exception:  # noqa: BLE001 - a failing job must not take the worker down
+        logger.exception("Insight job %s failed", job.id)
+    return job
+
+
+def run_session_jobs(session_id: int) -> int:
+    """Run a session's pending job inline, then any trailing job queued meanwhile.
+
+    Returns 0 without waiting when another process is mid-run; that process picks up the
+    pending job when it finishes.
+    """
+    processed = 0
+    while True:
+        job_id = (
+            InsightJob.objects.filter(session_id=session_id, status=InsightJobStatus.PENDING)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if job_id is None or not _claim(job_id):
+            return processed
+        run_insight_job(InsightJob.objects.select_related("session").get(id=job_id))
+        processed += 1
+
+
+def run_scoped_insights(session: WritingSession, block_indices: Collection[int]) -> list[Insight] | None:
+    """Score only the blocks at `block_indices` inline, as the session's running job.
+
+    The job row only marks the run as in flight and is deleted once it ends. Returns None,
+    scoring nothing, while another run of the session is in flight.
+    """
+    try:
+        with transaction.atomic():
+            job = InsightJob.objects.create(
+                session=session, status=InsightJobStatus.RUNNING, started_at=timezone.now()
+            )
+    except IntegrityError:
+        return None
+    try:
+        insights = generate_insights_for_session(session, block_indices=block_indices)
+    finally:
+        job.delete()
+    if jobs_eager():
+        run_session_jobs(session.id)
+    return insights
+
+
+def process_insight_jobs(limit: int | None = None) -> int:
+    """Run pending jobs until the queue is empty or `limit` jobs were processed."""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_insight_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,33 @@
+"""Compact old monthly insight event partitions into per-insight rollups."""
+
+from django.core.management.base import BaseCommand
+
+from core.events import compact_insight_events, enable_incremental_vacuum, reclaim_event_space, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold raw insight events older than MARS_INSIGHT_EVENT_RETENTION_MONTHS full months into "
+        "per-insight monthly rollups and delete them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-months", type=int, help="Override the number of full months kept raw.")
+        parser.add_argument("--no-vacuum", action="store_true", help="Leave freed pages in the database file.")
+        parser.add_argument(
+            "--enable-incremental-vacuum",
+            action="store_true",
+            help="First switch SQLite to incremental auto-vacuum (a one-off full VACUUM that locks the database).",
+        )
+
+    def handle(self, *args, **options):
+        if options["enable_incremental_vacuum"] and enable_incremental_vacuum():
+            self.stdout.write(self.style.SUCCESS("Switched the database to incremental auto-vacuum."))
+        cutoff = retention_cutoff(options["keep_months"])
+        partitions, deleted = compact_insight_events(cutoff)
+        self.stdout.write(
+            self.style.SUCCESS(f"Compacted {partitions} monthly partitions before {cutoff} ({deleted} events).")
+        )
+        if deleted and not options["no_vacuum"]:
+            pages = reclaim_event_space()
+            self.stdout.write(self.style.SUCCESS(f"Reclaimed {pages} database pages."))
@@ -0,0 +1,25 @@
+"""Delete raw sentiment snapshots that are already folded into rollups."""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.sentiment import compact_sentiment_snapshots
+
+
+class Command(BaseCommand):
+    help = "Delete sentiment snapshots older than the retention window; trends keep reading their rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=getattr(settings, "MARS_SENTIMENT_SNAPSHOT_RETENTION_DAYS", 365),
+            help="Keep snapshots written within this many days.",
+        )
+
+    def handle(self, *args, **options):
+        deleted = compact_sentiment_snapshots(timezone.now() - timedelta(days=options["older_than_days"]))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} sentiment snapshots."))
@@ -0,0 +1,16 @@
+"""Bound the persistent pair outcome memo."""
+
+from django.core.management.base import BaseCommand
+
+from core.memo import prune_pair_memo
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete pair memo rows from older heuristic versions or unused past MARS_PAIR_MEMO_TTL_DAYS, then "
+        "evict least recently used rows beyond MARS_PAIR_MEMO_MAX_ENTRIES or MARS_PAIR_MEMO_MAX_BYTES."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_pair_memo()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} pair memo rows."))
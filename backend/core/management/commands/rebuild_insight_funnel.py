@@ -0,0 +1,13 @@
+"""Recompute insight funnel counters from stored insight events."""
+
+from django.core.management.base import BaseCommand
+
+from core.funnel import rebuild_funnel_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day insight funnel counters from the insight event table."
+
+    def handle(self, *args, **options):
+        rows = rebuild_funnel_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} insight funnel counters."))
@@ -0,0 +1,41 @@
+"""Rebuild derived retrieval data for persisted blocks."""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from core.fingerprint import document_fingerprint
+from core.models import Block, BlockBucket, BlockToken, Document, Space
+from core.services import BLOCK_FEATURE_FIELDS, block_features_batch, index_blocks
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill stored block features and rebuild the token and LSH indexes and document fingerprints "
+        "used for candidate retrieval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Blocks processed per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        block_ids = list(Block.objects.order_by("id").values_list("id", flat=True))
+        postings = 0
+        for start in range(0, len(block_ids), batch_size):
+            chunk = block_ids[start : start + batch_size]
+            with transaction.atomic():
+                blocks = list(Block.objects.filter(id__in=chunk))
+                for block, features in zip(blocks, block_features_batch([block.text for block in blocks])):
+                    for field, value in features.items():
+                        setattr(block, field, value)
+                Block.objects.bulk_update(blocks, BLOCK_FEATURE_FIELDS)
+                BlockToken.objects.filter(block_id__in=chunk).delete()
+                BlockBucket.objects.filter(block_id__in=chunk).delete()
+                postings += index_blocks(blocks)
+        documents = list(Document.objects.prefetch_related("blocks"))
+        for document in documents:
+            document.fingerprint = document_fingerprint(block.token_array for block in document.blocks.all())
+        Document.objects.bulk_update(documents, ["fingerprint"], batch_size=batch_size)
+        Space.objects.update(blocks_version=F("blocks_version") + 1)
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {len(block_ids)} blocks ({postings} postings)."))
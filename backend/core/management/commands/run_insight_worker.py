@@ -0,0 +1,25 @@
+"""Process queued insight generation jobs."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import process_insight_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the insight generation worker that drains the database-backed job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+        parser.add_argument("--poll-interval", type=float, default=0.25, help="Seconds to sleep when idle.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_insight_jobs()
+            if processed:
+                self.stdout.write(f"Processed {processed} insight job(s).")
+            if options["once"]:
+                break
+            if not processed:
+                time.sleep(options["poll_interval"])
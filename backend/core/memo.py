@@ -0,0 +1,143 @@
+"""Persistent memo of pair classification outcomes keyed by paragraph content hashes."""
+
+from __future__ import annotations
+
+from array import array
+from datetime import timedelta
+from typing import Any, Sequence
+
+from django.conf import settings
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import PairScoreMemo
+from .scoring import HEURISTIC_VERSION, RankedSource
+
+
+def pair_memo_enabled() -> bool:
+    return getattr(settings, "MARS_PAIR_MEMO_ENABLED", True)
+
+
+def max_sources() -> int:
+    return getattr(settings, "MARS_PAIR_MEMO_MAX_SOURCES", 10_000)
+
+
+def _hash_key(content_hash: str) -> int:
+    """Shorten a SHA-256 hex digest to the 64-bit key stored in evaluated-source sets."""
+    return int(content_hash[:16], 16)
+
+
+class PairMemo:
+    """Memoized (current text, source text, mode) outcomes for a batch of current blocks.
+
+    Each row covers one current paragraph text in one mode: the set of source texts it has
+    been classified against, and the relation, score and reason of every source that
+    qualified. Sources in the set without an outcome are known non-matches, so a current
+    block whose candidates were all evaluated before is answered without scoring. A set that
+    would outgrow `MARS_PAIR_MEMO_MAX_SOURCES` starts over from the latest candidates.
+    """
+
+    def __init__(self, mode: str, current_blocks: Sequence[Any]):
+        self.mode = mode
+        hashes = {block.content_hash for block in current_blocks if block.content_hash}
+        self.rows = {
+            row.current_hash: row
+            for row in PairScoreMemo.objects.filter(
+                current_hash__in=hashes, mode=mode, heuristic_version=HEURISTIC_VERSION
+            )
+        }
+        self._evaluated: dict[str, set[int]] = {}
+        self._served: set[int] = set()
+        self._dirty: dict[str, PairScoreMemo] = {}
+
+    def _evaluated_for(self, row: PairScoreMemo) -> set[int]:
+        evaluated = self._evaluated.get(row.current_hash)
+        if evaluated is None:
+            keys = array("Q")
+            keys.frombytes(bytes(row.evaluated))
+            evaluated = self._evaluated[row.current_hash] = set(keys)
+        return evaluated
+
+    def lookup(self, current: Any, candidates: Sequence[Any], limit: int = 2) -> list[RankedSource] | None:
+        """Return the memoized top `limit` for `current`, or None if any candidate pair is unknown."""
+        row = self.rows.get(current.content_hash)
+        if row is None:
+            return None
+        evaluated = self._evaluated_for(row)
+        if any(not candidate.content_hash or _hash_key(candidate.content_hash) not in evaluated for candidate in candidates):
+            return None
+        outcomes = {source_hash: (relation, score, reason) for source_hash, relation, score, reason in row.outcomes}
+        results = []
+        for candidate in candidates:
+            outcome = outcomes.get(candidate.content_hash)
+            if outcome:
+                relation_type, score, reason = outcome
+                results.append(RankedSource(score, candidate, relation_type, reason))
+        # Candidates arrive most recent first; the stable sort keeps that order among equal scores.
+        results.sort(key=lambda item: item.score, reverse=True)
+        self._served.add(row.id)
+        return results[:limit]
+
+    def record(self, current: Any, candidates: Sequence[Any], qualifying: Sequence[RankedSource]) -> None:
+        """Remember that `current` was classified against `candidates`, with these qualifying sources."""
+        keys = {_hash_key(candidate.content_hash) for candidate in candidates if candidate.content_hash}
+        if not current.content_hash or not keys or len(keys) > max_sources():
+            return
+        row = self.rows.get(current.content_hash) or self._dirty.get(current.content_hash)
+        if row is None:
+            row = PairScoreMemo(
+                current_hash=current.content_hash, mode=self.mode, heuristic_version=HEURISTIC_VERSION, outcomes=[]
+            )
+        evaluated = self._evaluated_for(row) if row.evaluated else self._evaluated.setdefault(row.current_hash, set())
+        outcomes = {entry[0]: entry for entry in row.outcomes}
+        if len(evaluated | keys) > max_sources():
+            evaluated.clear()
+            outcomes = {}
+        evaluated.update(keys)
+        for item in qualifying:
+            if item.source.content_hash:
+                outcomes[item.source.content_hash] = [item.source.content_hash, item.relation_type, item.score, item.reason]
+        row.outcomes = sorted(outcomes.values())
+        row.evaluated = array("Q", sorted(evaluated)).tobytes()
+        self._dirty[row.current_hash] = row
+
+    def save(self) -> None:
+        """Persist recorded outcomes and refresh recency of served rows; `prune_pair_memo` bounds the table."""
+        now = timezone.now()
+        new, changed = [], []
+        for row in self._dirty.values():
+            row.last_used_at = now
+            (changed if row.pk else new).append(row)
+        PairScoreMemo.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+        if changed:
+            PairScoreMemo.objects.bulk_update(changed, ["evaluated", "outcomes", "last_used_at"], batch_size=500)
+        served = self._served - {row.pk for row in changed}
+        if served:
+            PairScoreMemo.objects.filter(id__in=served).update(last_used_at=now)
+        self._dirty.clear()
+        self._served.clear()
+
+
+def prune_pair_memo() -> int:
+    """Drop rows from older heuristic versions, rows unused past the TTL, and the least recently used overflow.
+
+    Overflow is whatever lies beyond `MARS_PAIR_MEMO_MAX_ENTRIES` rows or
+    `MARS_PAIR_MEMO_MAX_BYTES` of evaluated-source sets, most recently used rows first.
+    """
+    ttl = timedelta(days=getattr(settings, "MARS_PAIR_MEMO_TTL_DAYS", 30))
+    deleted, _ = PairScoreMemo.objects.exclude(heuristic_version=HEURISTIC_VERSION).delete()
+    deleted += PairScoreMemo.objects.filter(last_used_at__lt=timezone.now() - ttl).delete()[0]
+    max_entries = getattr(settings, "MARS_PAIR_MEMO_MAX_ENTRIES", 50_000)
+    max_bytes = getattr(settings, "MARS_PAIR_MEMO_MAX_BYTES", 256 * 1024 * 1024)
+    rows = PairScoreMemo.objects.order_by("-last_used_at", "-id").values_list("id", Length("evaluated"))
+    overflow: list[int] = []
+    kept = total = 0
+    for row_id, size in rows.iterator():
+        total += size or 0
+        if overflow or kept == max_entries or total > max_bytes:
+            overflow.append(row_id)
+        else:
+            kept += 1
+    for start in range(0, len(overflow), 500):
+        deleted += PairScoreMemo.objects.filter(id__in=overflow[start : start + 500]).delete()[0]
+    return deleted
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='core.block')),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_tokens', to='core.space')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'space', 'token'], name='core_blockt_user_id_caadb4_idx')],
+                'unique_together': {('block', 'token')},
+            },
+        ),
+    ]
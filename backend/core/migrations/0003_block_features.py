@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_block_token_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='is_foundational',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='block',
+            name='tokens',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_block_features'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='minhash',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.CreateModel(
+            name='BlockBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(max_length=32)),
+                ('block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='core.block')),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_buckets', to='core.space')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='block_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'space', 'bucket'], name='core_blockb_user_id_3d7257_idx')],
+                'unique_together': {('block', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_block_minhash_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
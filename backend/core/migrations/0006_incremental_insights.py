@@ -0,0 +1,25 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_block_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='writingsession',
+            name='insights_generated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
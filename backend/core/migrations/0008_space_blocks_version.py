@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_insight_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='space',
+            name='blocks_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:40
+
+from array import array
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of the lexicons in core.services, seeded so their term ids are stable.
+LEXICON_WORDS = [
+    "good", "great", "better", "happy", "calm", "confident", "progress", "win", "clear", "learned",
+    "bad", "worse", "stuck", "anxious", "angry", "sad", "confused", "failed", "hard", "overwhelmed",
+    "basics", "foundation", "intro", "introduction", "fundamental",
+]
+
+
+def _term_ids(Term, tokens):
+    keys = {token[:64] for token in tokens}
+    known = dict(Term.objects.filter(text__in=keys).values_list("text", "id"))
+    missing = keys.difference(known)
+    if missing:
+        Term.objects.bulk_create([Term(text=key) for key in missing], ignore_conflicts=True)
+        known.update(Term.objects.filter(text__in=missing).values_list("text", "id"))
+    return known
+
+
+def seed_lexicon(apps, schema_editor):
+    _term_ids(apps.get_model("core", "Term"), LEXICON_WORDS)
+
+
+def convert_tokens_to_term_ids(apps, schema_editor):
+    Term = apps.get_model("core", "Term")
+    Block = apps.get_model("core", "Block")
+    BlockToken = apps.get_model("core", "BlockToken")
+
+    for block in Block.objects.exclude(tokens="").iterator():
+        tokens = block.tokens.split()
+        vocabulary = _term_ids(Term, tokens)
+        block.token_ids = array("I", sorted({vocabulary[token[:64]] for token in tokens})).tobytes()
+        block.save(update_fields=["token_ids"])
+
+    for posting in BlockToken.objects.iterator():
+        posting.term_id = _term_ids(Term, [posting.token])[posting.token[:64]]
+        posting.save(update_fields=["term"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_space_blocks_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=64, unique=True)),
+            ],
+        ),
+        migrations.RunPython(seed_lexicon, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='block',
+            name='token_ids',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='blocktoken',
+            name='term',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='core.term'),
+        ),
+        migrations.RunPython(convert_tokens_to_term_ids, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='blocktoken',
+            unique_together={('block', 'term')},
+        ),
+        migrations.RemoveIndex(
+            model_name='blocktoken',
+            name='core_blockt_user_id_caadb4_idx',
+        ),
+        migrations.RemoveField(
+            model_name='blocktoken',
+            name='token',
+        ),
+        migrations.RemoveField(
+            model_name='block',
+            name='tokens',
+        ),
+        migrations.AlterField(
+            model_name='blocktoken',
+            name='term',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='core.term'),
+        ),
+        migrations.AddIndex(
+            model_name='blocktoken',
+            index=models.Index(fields=['user', 'space', 'term'], name='core_blockt_user_id_6542b0_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_term_vocabulary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='insightjob',
+            name='partial',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='writingsession',
+            name='insights_partial',
+            field=models.BooleanField(default=False),
+        ),
+    ]
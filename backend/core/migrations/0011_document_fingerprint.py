@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_insight_time_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='fingerprint',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
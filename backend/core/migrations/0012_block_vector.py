@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_document_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='block',
+            name='vector',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_block_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairScoreMemo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_hash', models.CharField(max_length=64)),
+                ('mode', models.CharField(choices=[('JOURNAL', 'Journal'), ('LEARNING', 'Learning')], max_length=20)),
+                ('heuristic_version', models.PositiveIntegerField()),
+                ('evaluated', models.BinaryField(blank=True, default=b'')),
+                ('outcomes', models.JSONField(blank=True, default=list)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'unique_together': {('current_hash', 'mode', 'heuristic_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """Keep the oldest pending and newest running job per session so the new constraints hold."""
+    InsightJob = apps.get_model("core", "InsightJob")
+    for status, error, newest_first in (("PENDING", "superseded", False), ("RUNNING", "interrupted", True)):
+        kept = set()
+        duplicates = []
+        jobs = InsightJob.objects.filter(status=status).order_by("-id" if newest_first else "id")
+        for job_id, session_id in jobs.values_list("id", "session_id"):
+            if session_id in kept:
+                duplicates.append(job_id)
+            kept.add(session_id)
+        InsightJob.objects.filter(id__in=duplicates).update(status="FAILED", error=error)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_document_save_receipt'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='insightjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'PENDING')), fields=('session',), name='one_pending_insight_job_per_session'),
+        ),
+        migrations.AddConstraint(
+            model_name='insightjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'RUNNING')), fields=('session',), name='one_running_insight_job_per_session'),
+        ),
+    ]
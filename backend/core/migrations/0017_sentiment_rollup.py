@@ -0,0 +1,68 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:06
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    """Fold every existing snapshot into the new rollups."""
+    SentimentSnapshot = apps.get_model("core", "SentimentSnapshot")
+    SentimentRollup = apps.get_model("core", "SentimentRollup")
+    rollups = {}
+    for user_id, space_id, score, created_at in SentimentSnapshot.objects.exclude(space=None).values_list(
+        "user_id", "space_id", "score", "created_at"
+    ):
+        day = timezone.localdate(created_at)
+        for period, start in (
+            ("DAY", day),
+            ("WEEK", day - timedelta(days=day.weekday())),
+            ("MONTH", day.replace(day=1)),
+        ):
+            key = (user_id, space_id, period, start)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = SentimentRollup(
+                    user_id=user_id, space_id=space_id, period=period, bucket_start=start,
+                    count=1, total=score, minimum=score, maximum=score,
+                )
+            else:
+                rollup.count += 1
+                rollup.total += score
+                rollup.minimum = min(rollup.minimum, score)
+                rollup.maximum = max(rollup.maximum, score)
+    SentimentRollup.objects.bulk_create(rollups.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_single_flight_insight_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SentimentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('DAY', 'Day'), ('WEEK', 'Week'), ('MONTH', 'Month')], max_length=8)),
+                ('bucket_start', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('minimum', models.FloatField(default=0.0)),
+                ('maximum', models.FloatField(default=0.0)),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sentiment_rollups', to='core.space')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sentiment_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'indexes': [models.Index(fields=['user', 'period', 'bucket_start'], name='core_sentim_user_id_3a4444_idx')],
+                'unique_together': {('user', 'space', 'period', 'bucket_start')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
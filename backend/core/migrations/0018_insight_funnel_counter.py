@@ -0,0 +1,65 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+STAGES = {
+    "INSIGHT_SHOWN": "shown",
+    "INSIGHT_OPENED": "opened",
+    "INSIGHT_MARKED_USEFUL": "useful",
+    "INSIGHT_DISMISSED": "dismissed",
+}
+
+
+def backfill_counters(apps, schema_editor):
+    """Count every existing insight event into the new funnel counters."""
+    InsightEvent = apps.get_model("core", "InsightEvent")
+    InsightFunnelCounter = apps.get_model("core", "InsightFunnelCounter")
+    counters = {}
+    grouped = (
+        InsightEvent.objects.annotate(day=TruncDate("created_at"))
+        .values("insight__session__space_id", "insight__relation_type", "insight__session__mode", "day", "event_type")
+        .annotate(events=Count("id"))
+        .order_by()
+    )
+    for row in grouped:
+        key = (row["insight__session__space_id"], row["insight__relation_type"], row["insight__session__mode"], row["day"])
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = InsightFunnelCounter(
+                space_id=key[0], relation_type=key[1], mode=key[2], day=key[3]
+            )
+        field = STAGES[row["event_type"]]
+        setattr(counter, field, getattr(counter, field) + row["events"])
+    InsightFunnelCounter.objects.bulk_create(counters.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_sentiment_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsightFunnelCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('relation_type', models.CharField(choices=[('CONTRADICTION', 'Contradiction'), ('REPETITION', 'Repetition'), ('EMOTIONAL_PATTERN', 'Emotional Pattern'), ('CONCEPTUAL_OVERLAP', 'Conceptual Overlap'), ('PREREQUISITE_LINK', 'Prerequisite Link')], max_length=40)),
+                ('mode', models.CharField(choices=[('JOURNAL', 'Journal'), ('LEARNING', 'Learning')], max_length=20)),
+                ('day', models.DateField()),
+                ('shown', models.PositiveIntegerField(default=0)),
+                ('opened', models.PositiveIntegerField(default=0)),
+                ('useful', models.PositiveIntegerField(default=0)),
+                ('dismissed', models.PositiveIntegerField(default=0)),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='insight_funnel_counters', to='core.space')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='core_insigh_day_b5b57b_idx')],
+                'unique_together': {('space', 'relation_type', 'mode', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_insight_funnel_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsightEventRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('event_type', models.CharField(choices=[('INSIGHT_SHOWN', 'Insight Shown'), ('INSIGHT_OPENED', 'Insight Opened'), ('INSIGHT_DISMISSED', 'Insight Dismissed'), ('INSIGHT_MARKED_USEFUL', 'Insight Marked Useful')], max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='insightevent',
+            index=models.Index(fields=['created_at'], name='core_insigh_created_8a9d78_idx'),
+        ),
+        migrations.AddField(
+            model_name='insighteventrollup',
+            name='insight',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_rollups', to='core.insight'),
+        ),
+        migrations.AddIndex(
+            model_name='insighteventrollup',
+            index=models.Index(fields=['month'], name='core_insigh_month_18bc35_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='insighteventrollup',
+            unique_together={('insight', 'month', 'event_type')},
+        ),
+    ]
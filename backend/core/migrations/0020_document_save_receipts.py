@@ -0,0 +1,32 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_insight_event_partitions'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='document',
+            name='last_save_key',
+        ),
+        migrations.CreateModel(
+            name='DocumentSaveReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=128)),
+                ('response', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='save_receipts', to='core.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['document', '-created_at'], name='core_docume_documen_bcbccb_idx')],
+                'unique_together': {('document', 'key')},
+            },
+        ),
+    ]
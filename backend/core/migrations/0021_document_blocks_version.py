@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_document_save_receipts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='blocks_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,6 @@
+from array import array
+from functools import cached_property
+
 from django.conf import settings
 from django.db import models
 
@@ -22,9 +25,32 @@ class InsightEventType(models.TextChoices):
     INSIGHT_MARKED_USEFUL = "INSIGHT_MARKED_USEFUL", "Insight Marked Useful"
 
 
+class RollupPeriod(models.TextChoices):
+    DAY = "DAY", "Day"
+    WEEK = "WEEK", "Week"
+    MONTH = "MONTH", "Month"
+
+
+class InsightJobStatus(models.TextChoices):
+    PENDING = "PENDING", "Pending"
+    RUNNING = "RUNNING", "Running"
+    DONE = "DONE", "Done"
+    FAILED = "FAILED", "Failed"
+
+
+class Term(models.Model):
+    """Deployment-wide vocabulary entry mapping a normalized token to a compact integer id."""
+
+    text = models.CharField(max_length=64, unique=True)
+
+    def __str__(self) -> str:
+        return self.text
+
+
 class Space(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="spaces")
     name = models.CharField(max_length=120)
+    blocks_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -41,6 +67,11 @@ class Document(models.Model):
     title = models.CharField(max_length=255)
     mode = models.CharField(max_length=20, choices=Mode.choices)
     content = models.TextField(blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    fingerprint = models.BinaryField(blank=True, default=b"")
+    revision = models.PositiveIntegerField(default=0)
+    blocks_version = models.PositiveIntegerField(default=0)
+    last_save_response = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -57,12 +88,59 @@ class Block(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="blocks")
     order_index = models.PositiveIntegerField()
     text = models.TextField()
+    content_hash = models.CharField(max_length=64, blank=True, default="")
     sentiment_score = models.FloatField(default=0.0)
+    token_ids = models.BinaryField(blank=True, default=b"")
+    token_count = models.PositiveIntegerField(default=0)
+    is_foundational = models.BooleanField(default=False)
+    minhash = models.BinaryField(blank=True, default=b"")
+    vector = models.BinaryField(blank=True, default=b"")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["document_id", "order_index"]
 
+    @cached_property
+    def token_array(self) -> array:
+        """Return the stored sorted term ids without re-parsing block text."""
+        ids = array("I")
+        ids.frombytes(bytes(self.token_ids))
+        return ids
+
+    @cached_property
+    def vector_array(self) -> array:
+        """Return the stored float32 similarity vector (empty unless the vector backend is enabled)."""
+        vector = array("f")
+        vector.frombytes(bytes(self.vector))
+        return vector
+
+
+class BlockToken(models.Model):
+    """Posting-list entry mapping a vocabulary term to a block within a user's space."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="block_tokens")
+    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name="block_tokens")
+    block = models.ForeignKey(Block, on_delete=models.CASCADE, related_name="postings")
+    term = models.ForeignKey(Term, on_delete=models.CASCADE, related_name="postings")
+
+    class Meta:
+        unique_together = ("block", "term")
+        indexes = [models.Index(fields=["user", "space", "term"])]
+
+
+class BlockBucket(models.Model):
+    """LSH band bucket for a block's MinHash signature within a user's space."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="block_buckets")
+    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name="block_buckets")
+    block = models.ForeignKey(Block, on_delete=models.CASCADE, related_name="buckets")
+    bucket = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = ("block", "bucket")
+        indexes = [models.Index(fields=["user", "space", "bucket"])]
+
 
 class WritingSession(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="sessions")
@@ -72,6 +150,8 @@ class WritingSession(models.Model):
     started_at = models.DateTimeField(auto_now_add=True)
     ended_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    insights_generated_at = models.DateTimeField(null=True, blank=True)
+    insights_partial = models.BooleanField(default=False)
 
     class Meta:
         ordering = ["-started_at"]
@@ -90,6 +170,62 @@ class Insight(models.Model):
         ordering = ["-score", "-created_at"]
 
 
+class DocumentSaveReceipt(models.Model):
+    """Response of a save made under an Idempotency-Key, replayed when the same key is retried."""
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="save_receipts")
+    key = models.CharField(max_length=128)
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("document", "key")
+        indexes = [models.Index(fields=["document", "-created_at"])]
+
+
+class PairScoreMemo(models.Model):
+    """Memoized classification outcomes of one paragraph text against previously seen source texts."""
+
+    current_hash = models.CharField(max_length=64)
+    mode = models.CharField(max_length=20, choices=Mode.choices)
+    heuristic_version = models.PositiveIntegerField()
+    evaluated = models.BinaryField(blank=True, default=b"")
+    outcomes = models.JSONField(default=list, blank=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ("current_hash", "mode", "heuristic_version")
+
+
+class InsightJob(models.Model):
+    """Queued insight generation run for a session; at most one per session is pending and one running."""
+
+    session = models.ForeignKey(WritingSession, on_delete=models.CASCADE, related_name="insight_jobs")
+    status = models.CharField(max_length=16, choices=InsightJobStatus.choices, default=InsightJobStatus.PENDING)
+    insight_count = models.PositiveIntegerField(default=0)
+    partial = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["session"],
+                condition=models.Q(status=InsightJobStatus.PENDING),
+                name="one_pending_insight_job_per_session",
+            ),
+            models.UniqueConstraint(
+                fields=["session"],
+                condition=models.Q(status=InsightJobStatus.RUNNING),
+                name="one_running_insight_job_per_session",
+            ),
+        ]
+
+
 class InsightEvent(models.Model):
     insight = models.ForeignKey(Insight, on_delete=models.CASCADE, related_name="events")
     session = models.ForeignKey(WritingSession, on_delete=models.SET_NULL, null=True, blank=True, related_name="insight_events")
@@ -99,6 +235,38 @@ class InsightEvent(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        # Monthly partitions are created_at ranges; compaction scans and drops them through this index.
+        indexes = [models.Index(fields=["created_at"])]
+
+
+class InsightEventRollup(models.Model):
+    """Per-insight event counts for one month whose raw events were compacted away."""
+
+    insight = models.ForeignKey(Insight, on_delete=models.CASCADE, related_name="event_rollups")
+    month = models.DateField()
+    event_type = models.CharField(max_length=32, choices=InsightEventType.choices)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("insight", "month", "event_type")
+        indexes = [models.Index(fields=["month"])]
+
+
+class InsightFunnelCounter(models.Model):
+    """Daily insight event counts per space, relation type and mode, kept current as events are recorded."""
+
+    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name="insight_funnel_counters")
+    relation_type = models.CharField(max_length=40, choices=InsightRelationType.choices)
+    mode = models.CharField(max_length=20, choices=Mode.choices)
+    day = models.DateField()
+    shown = models.PositiveIntegerField(default=0)
+    opened = models.PositiveIntegerField(default=0)
+    useful = models.PositiveIntegerField(default=0)
+    dismissed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("space", "relation_type", "mode", "day")
+        indexes = [models.Index(fields=["day"])]
 
 
 class SentimentSnapshot(models.Model):
@@ -113,6 +281,24 @@ class SentimentSnapshot(models.Model):
         ordering = ["-created_at"]
 
 
+class SentimentRollup(models.Model):
+    """Running sentiment aggregate of one user's snapshots in a space over a day, week or month."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="sentiment_rollups")
+    space = models.ForeignKey(Space, on_delete=models.CASCADE, related_name="sentiment_rollups")
+    period = models.CharField(max_length=8, choices=RollupPeriod.choices)
+    bucket_start = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0.0)
+    minimum = models.FloatField(default=0.0)
+    maximum = models.FloatField(default=0.0)
+
+    class Meta:
+        ordering = ["bucket_start"]
+        unique_together = ("user", "space", "period", "bucket_start")
+        indexes = [models.Index(fields=["user", "period", "bucket_start"])]
+
+
 class StreakState(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="streak_state")
     current_streak = models.PositiveIntegerField(default=0)
@@ -0,0 +1,310 @@
+"""Relation rules and the batch scorer used to rank insight candidates."""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Sequence
+
+import django
+from django.conf import settings
+
+from .models import Block, InsightRelationType, Mode
+from .vectors import cosine, overlap_from_cosine, vector_backend_enabled
+
+MIN_OVERLAP = 0.12
+# Bump whenever relation rules or stored block features change, to invalidate memoized pair outcomes.
+HEURISTIC_VERSION = 1
+
+
+class ScoringFeatures(NamedTuple):
+    """Picklable subset of block attributes the scorer reads, shipped to pool workers."""
+
+    id: int
+    token_array: array
+    token_count: int
+    sentiment_score: float
+    is_foundational: bool
+
+
+class RankedSource(NamedTuple):
+    score: float
+    source: Block
+    relation_type: str
+    reason: str
+
+
+def relation_for_overlap(
+    mode: str, overlap: float, current_sentiment: float, source_sentiment: float, source_foundational: bool
+) -> tuple[str, float, str] | None:
+    """Apply the mode-specific relation thresholds to a pair's precomputed overlap and sentiment."""
+    if overlap < MIN_OVERLAP:
+        return None
+
+    sentiment_gap = abs(current_sentiment - source_sentiment)
+    opposite_direction = current_sentiment * source_sentiment < 0
+
+    if mode == Mode.JOURNAL:
+        if overlap > 0.22 and opposite_direction and sentiment_gap > 0.2:
+            return (
+                InsightRelationType.CONTRADICTION,
+                overlap + sentiment_gap,
+                "You expressed an opposite emotional direction on a similar topic before.",
+            )
+        if overlap > 0.25:
+            return (
+                InsightRelationType.REPETITION,
+                overlap,
+                "This theme appears similar to a prior journal reflection.",
+            )
+        if sentiment_gap > 0.3:
+            return (
+                InsightRelationType.EMOTIONAL_PATTERN,
+                sentiment_gap,
+                "Your emotional tone differs meaningfully from a past entry.",
+            )
+        return None
+
+    if overlap > 0.22:
+        return (
+            InsightRelationType.CONCEPTUAL_OVERLAP,
+            overlap,
+            "This concept overlaps with something you already wrote about.",
+        )
+    if source_foundational:
+        return (
+            InsightRelationType.PREREQUISITE_LINK,
+            0.15 + overlap,
+            "A prior foundational note may help with this concept.",
+        )
+    return None
+
+
+def rank_batch(
+    mode: str, current_blocks: Sequence[Block], candidates: Sequence[Block], limit: int | None = 2
+) -> dict[int, list[RankedSource]]:
+    """Rank candidates for many current blocks at once, keeping the top `limit` per block (all if None).
+
+    Candidate term ids are inverted into column posting lists (a sparse term x candidate
+    incidence matrix), so each current block's intersection sizes come from one sparse
+    row-times-matrix pass that only visits candidates sharing a token. Union sizes follow
+    from stored token counts. Results match pairwise `classify_relation` exactly, including
+    tie order: candidates keep their input (recency) order before the stable score sort.
+    """
+    postings: dict[int, list[int]] = {}
+    for column, candidate in enumerate(candidates):
+        for token in candidate.token_array:
+            postings.setdefault(token, []).append(column)
+
+    ranked: dict[int, list[RankedSource]] = {}
+    for current in current_blocks:
+        shared: dict[int, int] = {}
+        for token in current.token_array:
+            for column in postings.get(token, ()):
+                shared[column] = shared.get(column, 0) + 1
+
+        results: list[RankedSource] = []
+        for column in sorted(shared):
+            source = candidates[column]
+            intersection = shared[column]
+            overlap = intersection / (current.token_count + source.token_count - intersection)
+            classified = relation_for_overlap(
+                mode, overlap, current.sentiment_score, source.sentiment_score, source.is_foundational
+            )
+            if classified:
+                relation_type, score, reason = classified
+                results.append(RankedSource(score, source, relation_type, reason))
+
+        results.sort(key=lambda item: item.score, reverse=True)
+        ranked[current.id] = results[:limit]
+    return ranked
+
+
+def rank_vectors(
+    mode: str, current_blocks: Sequence[Block], candidates: Sequence[Block], limit: int | None = 2
+) -> dict[int, list[RankedSource]]:
+    """Rank candidates by cosine similarity of stored vectors, mapped onto the overlap scale.
+
+    Tie order matches `rank_batch`: candidates keep their input (recency) order before the
+    stable score sort.
+    """
+    ranked: dict[int, list[RankedSource]] = {}
+    for current in current_blocks:
+        results: list[RankedSource] = []
+        for source in candidates:
+            overlap = overlap_from_cosine(cosine(current.vector_array, source.vector_array))
+            classified = relation_for_overlap(
+                mode, overlap, current.sentiment_score, source.sentiment_score, source.is_foundational
+            )
+            if classified:
+                relation_type, score, reason = classified
+                results.append(RankedSource(score, source, relation_type, reason))
+        results.sort(key=lambda item: item.score, reverse=True)
+        ranked[current.id] = results[:limit]
+    return ranked
+
+
+def _features(block: Block) -> ScoringFeatures:
+    return ScoringFeatures(block.id, block.token_array, block.token_count, block.sentiment_score, block.is_foundational)
+
+
+def _rank_tile(
+    mode: str, current_blocks: list[ScoringFeatures], candidates: list[ScoringFeatures], offset: int, limit: int | None
+) -> dict[int, list[tuple[float, int, str, str]]]:
+    """Rank one tile of the grid in a worker, reporting sources by global candidate column."""
+    columns = {candidate.id: offset + column for column, candidate in enumerate(candidates)}
+    return {
+        current_id: [(item.score, columns[item.source.id], item.relation_type, item.reason) for item in results]
+        for current_id, results in rank_batch(mode, current_blocks, candidates, limit).items()
+    }
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def scoring_workers() -> int:
+    """Return the configured pool size, defaulting to the machine's core count."""
+    return getattr(settings, "MARS_SCORING_WORKERS", None) or os.cpu_count() or 1
+
+
+def _executor() -> ProcessPoolExecutor:
+    """Return the shared scoring pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers import this module to unpickle tasks, which needs configured Django apps.
+            _pool = ProcessPoolExecutor(max_workers=scoring_workers(), initializer=django.setup)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """Stop the shared scoring pool's workers; the next parallel rank starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _chunks(items: Sequence, count: int) -> list[tuple[int, Sequence]]:
+    """Split items into at most `count` contiguous (offset, slice) chunks."""
+    size = max(1, -(-len(items) // count))
+    return [(start, items[start : start + size]) for start in range(0, len(items), size)]
+
+
+def rank_parallel(
+    mode: str, current_blocks: Sequence[Block], candidates: Sequence[Block], limit: int | None = 2
+) -> dict[int, list[RankedSource]]:
+    """Rank the current x candidate grid across a process pool.
+
+    The grid is tiled over both axes so a single long paragraph against a large space still
+    spreads across cores. Each tile returns its own top `limit`, and tiles are merged by
+    (score, candidate column), which reproduces the serial stable sort exactly.
+    """
+    workers = scoring_workers()
+    rows = _chunks([_features(block) for block in current_blocks], workers)
+    columns = _chunks([_features(block) for block in candidates], max(1, workers // len(rows)))
+    futures = [
+        _executor().submit(_rank_tile, mode, list(row), list(column), offset, limit)
+        for _, row in rows
+        for offset, column in columns
+    ]
+
+    merged: dict[int, list[tuple[float, int, str, str]]] = {block.id: [] for block in current_blocks}
+    for future in futures:
+        for current_id, results in future.result().items():
+            merged[current_id].extend(results)
+    return _merge_top(merged, candidates, limit)
+
+
+def _merge_top(
+    merged: dict[int, list[tuple[float, int, str, str]]], candidates: Sequence[Block], limit: int | None
+) -> dict[int, list[RankedSource]]:
+    """Keep the top `limit` per current block, breaking score ties by candidate column (recency)."""
+    return {
+        current_id: [
+            RankedSource(score, candidates[column], relation_type, reason)
+            for score, column, relation_type, reason in sorted(results, key=lambda item: (-item[0], item[1]))[:limit]
+        ]
+        for current_id, results in merged.items()
+    }
+
+
+def _use_pool(current_count: int, candidate_count: int) -> bool:
+    """Return whether a lexical workload of this many pairs is worth spreading across the pool."""
+    threshold = getattr(settings, "MARS_PARALLEL_SCORING_MIN_PAIRS", 250_000)
+    return bool(threshold) and scoring_workers() > 1 and current_count * candidate_count >= threshold
+
+
+def rank_candidates(
+    mode: str, current_blocks: Sequence[Block], candidates: Sequence[Block], limit: int | None = 2
+) -> dict[int, list[RankedSource]]:
+    """Rank with the configured similarity backend; lexical workloads above the configured size use the pool."""
+    if vector_backend_enabled():
+        return rank_vectors(mode, current_blocks, candidates, limit)
+    if _use_pool(len(current_blocks), len(candidates)):
+        return rank_parallel(mode, current_blocks, candidates, limit)
+    return rank_batch(mode, current_blocks, candidates, limit)
+
+
+def rank_anytime(
+    mode: str, current_blocks: Sequence[Block], candidates: Sequence[Block], deadline: float | None, limit: int | None = 2
+) -> tuple[dict[int, list[RankedSource]], bool]:
+    """Rank candidates in priority order until `deadline` (a `time.monotonic()` value) passes.
+
+    Candidates sharing the most terms with the current text go first, most recent first
+    among equals. Scoring proceeds in chunks of about `MARS_ANYTIME_CHUNK_PAIRS` pairs and
+    stops at the first chunk boundary past the deadline (possibly before the first chunk),
+    returning the best insights found so far and whether the pass was cut short. Lexical
+    workloads big enough for the process pool score one chunk per worker between clock
+    checks. A pass that finishes is identical to `rank_candidates` over every candidate.
+    """
+    if deadline is None or not current_blocks:
+        return rank_candidates(mode, current_blocks, candidates, limit), False
+
+    current_terms: set[int] = set()
+    for block in current_blocks:
+        current_terms.update(block.token_array)
+    priority = sorted(
+        range(len(candidates)),
+        key=lambda column: -sum(1 for term in candidates[column].token_array if term in current_terms),
+    )
+    # Small chunks keep the overshoot past the deadline to a few milliseconds.
+    chunk_size = max(1, getattr(settings, "MARS_ANYTIME_CHUNK_PAIRS", 4096) // len(current_blocks))
+    chunks = [priority[start : start + chunk_size] for start in range(0, len(priority), chunk_size)]
+    pooled = not vector_backend_enabled() and _use_pool(len(current_blocks), len(candidates))
+    step = scoring_workers() if pooled else 1
+    current_features = [_features(block) for block in current_blocks] if pooled else []
+
+    merged: dict[int, list[tuple[float, int, str, str]]] = {block.id: [] for block in current_blocks}
+    partial = False
+    for start in range(0, len(chunks), step):
+        if time.monotonic() >= deadline:
+            partial = True
+            break
+        batch = chunks[start : start + step]
+        if pooled:
+            futures = [
+                _executor().submit(
+                    _rank_tile, mode, current_features, [_features(candidates[column]) for column in columns], 0, limit
+                )
+                for columns in batch
+            ]
+            for columns, future in zip(batch, futures):
+                for current_id, results in future.result().items():
+                    merged[current_id].extend(
+                        (score, columns[index], relation_type, reason) for score, index, relation_type, reason in results
+                    )
+            continue
+        columns = batch[0]
+        column_of = {candidates[column].id: column for column in columns}
+        chunk = rank_candidates(mode, current_blocks, [candidates[column] for column in columns], limit)
+        for current_id, results in chunk.items():
+            merged[current_id].extend(
+                (item.score, column_of[item.source.id], item.relation_type, item.reason) for item in results
+            )
+    return _merge_top(merged, candidates, limit), partial
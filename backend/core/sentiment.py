@@ -0,0 +1,106 @@
+"""Sentiment rollups maintained as snapshots are written, and downsampled trend reads over them."""
+
+from __future__ import annotations
+
+import math
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Min, Sum, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import RollupPeriod, SentimentRollup, SentimentSnapshot
+
+
+def bucket_start(period: str, day: date) -> date:
+    """Return the first day of the `period` bucket containing `day` (weeks start on Monday)."""
+    if period == RollupPeriod.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == RollupPeriod.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def record_sentiment(snapshot: SentimentSnapshot) -> None:
+    """Fold a newly written snapshot into its daily, weekly and monthly rollups."""
+    if snapshot.space_id is None:
+        return
+    day = timezone.localdate(snapshot.created_at)
+    for period in RollupPeriod.values:
+        key = {
+            "user_id": snapshot.user_id,
+            "space_id": snapshot.space_id,
+            "period": period,
+            "bucket_start": bucket_start(period, day),
+        }
+        score = Value(snapshot.score)
+        while not SentimentRollup.objects.filter(**key).update(
+            count=F("count") + 1,
+            total=F("total") + score,
+            minimum=Least("minimum", score),
+            maximum=Greatest("maximum", score),
+        ):
+            try:
+                with transaction.atomic():
+                    SentimentRollup.objects.create(
+                        **key, count=1, total=snapshot.score, minimum=snapshot.score, maximum=snapshot.score
+                    )
+                break
+            except IntegrityError:
+                continue  # another writer created the bucket first; add to it
+
+
+def trend_period(start: date, end: date, points: int) -> str:
+    """Pick the finest rollup period that covers `start`..`end` in roughly `points` buckets."""
+    days = (end - start).days + 1
+    if days <= points:
+        return RollupPeriod.DAY
+    if days <= points * 7:
+        return RollupPeriod.WEEK
+    return RollupPeriod.MONTH
+
+
+def sentiment_trend(
+    user_id: int, space_id: int | None, start: date, end: date, points: int
+) -> tuple[str, list[dict[str, Any]]]:
+    """Return the rollup period read and at most `points` count-weighted sentiment points.
+
+    Buckets are read from the finest period that fits, summed across spaces unless
+    `space_id` is given, and merged in equal runs when there are still more than `points`.
+    Edge weeks and months may include days just outside the range.
+    """
+    period = trend_period(start, end, points)
+    rows = SentimentRollup.objects.filter(
+        user_id=user_id, period=period, bucket_start__gte=bucket_start(period, start), bucket_start__lte=end
+    )
+    if space_id is not None:
+        rows = rows.filter(space_id=space_id)
+    buckets = list(
+        rows.values("bucket_start")
+        .annotate(count=Sum("count"), total=Sum("total"), minimum=Min("minimum"), maximum=Max("maximum"))
+        .order_by("bucket_start")
+    )
+
+    size = max(1, math.ceil(len(buckets) / points))
+    trend = []
+    for offset in range(0, len(buckets), size):
+        run = buckets[offset : offset + size]
+        count = sum(bucket["count"] for bucket in run)
+        trend.append(
+            {
+                "start": run[0]["bucket_start"],
+                "count": count,
+                "mean": round(sum(bucket["total"] for bucket in run) / count, 4),
+                "min": min(bucket["minimum"] for bucket in run),
+                "max": max(bucket["maximum"] for bucket in run),
+            }
+        )
+    return period, trend
+
+
+def compact_sentiment_snapshots(before: datetime) -> int:
+    """Delete raw snapshots written before `before`; their scores remain in the rollups."""
+    deleted, _ = SentimentSnapshot.objects.filter(created_at__lt=before).delete()
+    return deleted
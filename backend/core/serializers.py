@@ -2,10 +2,14 @@
 
 from __future__ import annotations
 
+from datetime import timedelta
+from typing import Any
+
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Document, Insight, InsightEventType, Mode, Space, WritingSession
+from .models import Document, Insight, InsightEventType, InsightJob, InsightRelationType, Mode, Space, WritingSession
 
 
 class SpaceSerializer(serializers.ModelSerializer):
@@ -21,7 +25,7 @@ class DocumentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Document
-        fields = ["id", "title", "mode", "space_id", "updated_at"]
+        fields = ["id", "title", "mode", "space_id", "revision", "updated_at"]
 
 
 class WritingSessionSerializer(serializers.ModelSerializer):
@@ -32,6 +36,24 @@ class WritingSessionSerializer(serializers.ModelSerializer):
         fields = ["id", "space_id", "document_id", "mode", "is_active", "started_at", "ended_at"]
 
 
+class InsightJobSerializer(serializers.ModelSerializer):
+    """Serializes queued insight generation status for client polling."""
+
+    class Meta:
+        model = InsightJob
+        fields = [
+            "id",
+            "session_id",
+            "status",
+            "insight_count",
+            "partial",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
 class BootstrapSerializer(serializers.Serializer):
     """Top-level bootstrap response payload for initial client hydration."""
 
@@ -66,13 +88,39 @@ class CreateSessionSerializer(serializers.Serializer):
     mode = serializers.ChoiceField(choices=[Mode.JOURNAL, Mode.LEARNING])
 
 
+class BlockOperationSerializer(serializers.Serializer):
+    """Validates one paragraph operation of a delta save."""
+
+    op = serializers.ChoiceField(choices=["insert", "replace", "delete"])
+    index = serializers.IntegerField(min_value=0)
+    text = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+
+    def validate(self, attrs: dict[str, Any]) -> dict[str, Any]:
+        if attrs["op"] != "delete" and "text" not in attrs:
+            raise serializers.ValidationError({"text": f"required for {attrs['op']}"})
+        return attrs
+
+
 class SaveBlocksSerializer(serializers.Serializer):
-    """Validates block sync payloads for a document session."""
+    """Validates block sync payloads for a document session: full text, or paragraph operations."""
 
     session_id = serializers.IntegerField()
-    text = serializers.CharField(required=False, allow_blank=True, default="")
+    text = serializers.CharField(required=False, allow_blank=True)
+    operations = BlockOperationSerializer(many=True, required=False)
+    base_revision = serializers.IntegerField(required=False, min_value=0)
+    active_blocks = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), required=False, allow_empty=True, max_length=16
+    )
     finalize = serializers.BooleanField(required=False, default=False)
 
+    def validate(self, attrs: dict[str, Any]) -> dict[str, Any]:
+        if "operations" in attrs:
+            if "text" in attrs:
+                raise serializers.ValidationError("send either text or operations, not both")
+            if "base_revision" not in attrs:
+                raise serializers.ValidationError({"base_revision": "required with operations"})
+        return attrs
+
 
 class InsightSerializer(serializers.ModelSerializer):
     """Serializes computed insights with source/current excerpts for display."""
@@ -84,6 +132,7 @@ class InsightSerializer(serializers.ModelSerializer):
         model = Insight
         fields = [
             "id",
+            "current_block_id",
             "relation_type",
             "reason_text",
             "score",
@@ -114,6 +163,51 @@ class CreateInsightEventSerializer(serializers.Serializer):
     metadata = serializers.DictField(required=False, default=dict)
 
 
+class InsightEventItemSerializer(CreateInsightEventSerializer):
+    """Validates one event of a batch, naming its insight."""
+
+    insight_id = serializers.IntegerField()
+
+
+class InsightEventBatchSerializer(serializers.Serializer):
+    """Validates a batch of insight events recorded in one request."""
+
+    events = InsightEventItemSerializer(many=True, allow_empty=False, max_length=500)
+
+
+class DateRangeQuerySerializer(serializers.Serializer):
+    """Validates a user, optional space and inclusive day range ending today by default."""
+
+    default_days = 365
+
+    user_id = serializers.IntegerField(required=False)
+    space_id = serializers.IntegerField(required=False)
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs: dict[str, Any]) -> dict[str, Any]:
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=self.default_days - 1))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError("start must not be after end")
+        return attrs
+
+
+class SentimentTrendQuerySerializer(DateRangeQuerySerializer):
+    """Validates sentiment trend query parameters; the range defaults to the last year."""
+
+    points = serializers.IntegerField(required=False, default=90, min_value=1, max_value=1000)
+
+
+class InsightFunnelQuerySerializer(DateRangeQuerySerializer):
+    """Validates insight funnel filters; the range defaults to the last 30 days."""
+
+    default_days = 30
+
+    mode = serializers.ChoiceField(choices=Mode.choices, required=False)
+    relation_type = serializers.ChoiceField(choices=InsightRelationType.choices, required=False)
+
+
 class UserSummarySerializer(serializers.ModelSerializer):
     """Serializes minimal user identity for bootstrap payloads."""
 
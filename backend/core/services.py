@@ -1,20 +1,42 @@
+import hashlib
+import heapq
+import itertools
+import math
 import re
-from datetime import timedelta
-from typing import Iterable
+import time
+from datetime import datetime, timedelta
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Collection, Iterable, Iterator, NamedTuple, Sequence
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import QuerySet
+from django.db import router, transaction
+from django.db.models import Count, F, Q, QuerySet
 from django.utils import timezone
 
+from .cache import candidate_cache
+from .fingerprint import FingerprintQuery, document_fingerprint
+from .lsh import lsh_bucket_keys, minhash_signature, pack_signature, unpack_signature
+from .memo import PairMemo, pair_memo_enabled
 from .models import (
     Block,
+    BlockBucket,
+    BlockToken,
+    Document,
+    DocumentSaveReceipt,
     Insight,
-    InsightRelationType,
-    Mode,
     SentimentSnapshot,
+    Space,
     StreakState,
+    Term,
     WritingSession,
 )
+from .scoring import MIN_OVERLAP, RankedSource, rank_anytime, rank_candidates, relation_for_overlap
+from .sentiment import record_sentiment
+from .vectors import cosine, hyperplane_bucket_keys, tfidf_vector, vector_backend_enabled
+from .vocabulary import intersection_size, sorted_id_array, term_ids
 
 POSITIVE_WORDS = {
     "good",
@@ -64,124 +86,738 @@ STOP_WORDS = {
     "some",
     "than",
 }
+PREREQUISITE_TERMS = {"basics", "foundation", "intro", "introduction", "fundamental"}
+BLOCK_FEATURE_FIELDS = [
+    "content_hash",
+    "token_ids",
+    "token_count",
+    "is_foundational",
+    "sentiment_score",
+    "minhash",
+    "vector",
+]
+# Paragraphs segmented and featurized at a time while syncing a document.
+SYNC_BATCH_SIZE = 500
+
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+WORD_BREAK = re.compile(r"\s+")
+# A run of lines that each hold some non-whitespace character.
+PARAGRAPH = re.compile(r"(?:^[^\S\n]*\S[^\n]*(?:\n|\Z))+", re.MULTILINE)
+
+
+def max_block_chars() -> int:
+    """Return the configured upper bound on block length."""
+    return getattr(settings, "MARS_MAX_BLOCK_CHARS", 2000)
+
+
+def _skip_space(text: str, position: int) -> int:
+    match = WORD_BREAK.match(text, position)
+    return match.end() if match else position
+
+
+def _bounded(paragraph: str, limit: int) -> Iterator[str]:
+    """Split an overlong paragraph at the last sentence break (else word break) within `limit`."""
+    end = len(paragraph)
+    start = _skip_space(paragraph, 0)
+    while end - start > limit:
+        cut = None
+        for pattern in (SENTENCE_BREAK, WORD_BREAK):
+            for match in pattern.finditer(paragraph, start + 1, start + limit + 1):
+                cut = match.start()
+            if cut is not None:
+                break
+        if cut is None:
+            cut = start + limit
+        yield paragraph[start:cut]
+        # The window may end inside a whitespace run; the next piece starts after all of it.
+        start = _skip_space(paragraph, cut)
+    if start < end:
+        yield paragraph[start:]
+
+
+def iter_blocks(text: str | Iterable[str], limit: int | None = None) -> Iterator[str]:
+    """Lazily split note content into paragraph blocks of at most `limit` characters.
+
+    `text` may be a string, scanned in place, or any iterable of lines (such as an open
+    file). Paragraphs are separated by blank lines and only one paragraph is buffered at a
+    time; paragraphs over the limit are cut at sentence boundaries.
+    """
+    limit = limit or max_block_chars()
+    if isinstance(text, str):
+        for match in PARAGRAPH.finditer(text):
+            yield from _bounded(match.group().strip(), limit)
+        return
+    paragraph: list[str] = []
+    for line in itertools.chain(text, [""]):
+        if line.strip():
+            paragraph.append(line)
+            continue
+        if paragraph:
+            yield from _bounded("".join(paragraph).strip(), limit)
+            paragraph.clear()
 
 
 def segment_blocks(text: str) -> list[str]:
     """Split raw note content into paragraph-sized retrievable blocks."""
-    parts = [part.strip() for part in re.split(r"\n\s*\n", text) if part.strip()]
-    return parts or [text.strip()] if text.strip() else []
+    return list(iter_blocks(text))
+
+
+def token_counts(text: str) -> Counter[str]:
+    """Count normalized non-stopword tokens, for term-frequency weighting."""
+    words = re.findall(r"[a-zA-Z]{4,}", text.lower())
+    return Counter(word for word in words if word not in STOP_WORDS)
 
 
 def tokenize(text: str) -> set[str]:
     """Return normalized non-stopword tokens used for similarity heuristics."""
-    words = re.findall(r"[a-zA-Z]{4,}", text.lower())
-    return {word for word in words if word not in STOP_WORDS}
+    return set(token_counts(text))
 
 
-def sentiment_score(text: str) -> float:
-    """Compute a simple lexical sentiment score in the range [-1, 1]."""
-    tokens = tokenize(text)
-    if not tokens:
+class Lexicon(NamedTuple):
+    positive: array
+    negative: array
+    prerequisite: array
+
+
+@lru_cache(maxsize=None)
+def _lexicon(alias: str) -> Lexicon:
+    ids = term_ids(POSITIVE_WORDS | NEGATIVE_WORDS | PREREQUISITE_TERMS)
+    return Lexicon(
+        *(sorted_id_array(ids[word] for word in words) for words in (POSITIVE_WORDS, NEGATIVE_WORDS, PREREQUISITE_TERMS))
+    )
+
+
+def lexicon() -> Lexicon:
+    """Resolve the sentiment and prerequisite word lists to sorted vocabulary ids.
+
+    The words are seeded into the vocabulary by migration; any that went missing are
+    registered again. Ids are cached per database until `clear_lexicon` (run after every
+    migrate or flush).
+    """
+    return _lexicon(router.db_for_write(Term))
+
+
+def clear_lexicon(**kwargs: Any) -> None:
+    _lexicon.cache_clear()
+
+
+def sentiment_score(token_ids: Sequence[int]) -> float:
+    """Compute a simple lexical sentiment score in the range [-1, 1] from sorted term ids."""
+    if not token_ids:
         return 0.0
-    pos = len(tokens.intersection(POSITIVE_WORDS))
-    neg = len(tokens.intersection(NEGATIVE_WORDS))
-    return (pos - neg) / max(len(tokens), 1)
+    words = lexicon()
+    pos = intersection_size(token_ids, words.positive)
+    neg = intersection_size(token_ids, words.negative)
+    return (pos - neg) / max(len(token_ids), 1)
+
+
+def content_hash(text: str) -> str:
+    """Return the stable digest used to match paragraphs against stored blocks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def inverse_document_frequencies(vocabulary: dict[str, int]) -> dict[str, float]:
+    """Return smoothed deployment-wide IDF weights for tokens, from posting counts."""
+    frequencies = dict(
+        BlockToken.objects.filter(term_id__in=vocabulary.values())
+        .values("term_id")
+        .annotate(blocks=Count("id"))
+        .values_list("term_id", "blocks")
+    )
+    total = Block.objects.count()
+    return {
+        token: math.log((1 + total) / (1 + frequencies.get(term_id, 0))) + 1.0 for token, term_id in vocabulary.items()
+    }
 
 
-def jaccard(a: set[str], b: set[str]) -> float:
-    """Measure token overlap between two sets using Jaccard similarity."""
+def block_features_batch(texts: Sequence[str]) -> list[dict[str, Any]]:
+    """Compute stored similarity features for many blocks with one vocabulary round trip."""
+    counted = [token_counts(text) for text in texts]
+    tokenized = [set(counts) for counts in counted]
+    vocabulary = term_ids(set().union(*tokenized))
+    idf = inverse_document_frequencies(vocabulary) if vector_backend_enabled() else None
+    features = []
+    for text, tokens, counts in zip(texts, tokenized, counted):
+        ids = sorted_id_array(vocabulary[token] for token in tokens)
+        features.append(
+            {
+                "content_hash": content_hash(text),
+                "token_ids": ids.tobytes(),
+                "token_count": len(ids),
+                "is_foundational": bool(intersection_size(ids, lexicon().prerequisite)),
+                "sentiment_score": round(sentiment_score(ids), 4),
+                "minhash": pack_signature(minhash_signature(tokens)),
+                "vector": tfidf_vector(counts, idf).tobytes() if idf is not None else b"",
+            }
+        )
+    return features
+
+
+def block_features(text: str) -> dict[str, Any]:
+    """Compute the stored similarity features for a block once at write time."""
+    return block_features_batch([text])[0]
+
+
+def jaccard(a: Sequence, b: Sequence) -> float:
+    """Measure overlap between two sorted, duplicate-free sequences using Jaccard similarity."""
     if not a or not b:
         return 0.0
-    union = a.union(b)
-    if not union:
-        return 0.0
-    return len(a.intersection(b)) / len(union)
+    shared = intersection_size(a, b)
+    return shared / (len(a) + len(b) - shared)
 
 
-def classify_relation(mode: str, current: Block, source: Block) -> tuple[str, float, str] | None:
-    """Classify the semantic relation between current and source blocks for a mode."""
-    current_tokens = tokenize(current.text)
-    source_tokens = tokenize(source.text)
-    overlap = jaccard(current_tokens, source_tokens)
-    if overlap < 0.12:
-        return None
+def index_blocks(blocks: Iterable[Block]) -> int:
+    """Write token postings and LSH buckets (MinHash, plus hyperplane buckets for vectors) for retrieval."""
+    postings: list[BlockToken] = []
+    buckets: list[BlockBucket] = []
+    for block in blocks:
+        for term_id in block.token_array:
+            postings.append(BlockToken(user_id=block.user_id, space_id=block.space_id, block=block, term_id=term_id))
+        keys = {*lsh_bucket_keys(unpack_signature(block.minhash)), *hyperplane_bucket_keys(block.vector_array)}
+        for key in keys:
+            buckets.append(BlockBucket(user_id=block.user_id, space_id=block.space_id, block=block, bucket=key))
+    BlockToken.objects.bulk_create(postings, batch_size=500)
+    BlockBucket.objects.bulk_create(buckets, batch_size=500)
+    return len(postings)
 
-    sentiment_gap = abs(current.sentiment_score - source.sentiment_score)
-    opposite_direction = current.sentiment_score * source.sentiment_score < 0
 
-    if mode == Mode.JOURNAL:
-        if overlap > 0.22 and opposite_direction and sentiment_gap > 0.2:
-            return (
-                InsightRelationType.CONTRADICTION,
-                overlap + sentiment_gap,
-                "You expressed an opposite emotional direction on a similar topic before.",
-            )
-        if overlap > 0.25:
-            return (
-                InsightRelationType.REPETITION,
-                overlap,
-                "This theme appears similar to a prior journal reflection.",
-            )
-        if sentiment_gap > 0.3:
-            return (
-                InsightRelationType.EMOTIONAL_PATTERN,
-                sentiment_gap,
-                "Your emotional tone differs meaningfully from a past entry.",
+def _recent_first(block_ids: QuerySet, since: datetime | None) -> QuerySet[Block]:
+    """Materialize candidate ids as blocks, optionally limited to those changed after `since`."""
+    blocks = Block.objects.filter(id__in=block_ids)
+    if since:
+        blocks = blocks.filter(updated_at__gt=since)
+    return blocks.order_by("-created_at", "-id")
+
+
+def candidate_blocks_for(
+    session: WritingSession, token_ids: Iterable[int], since: datetime | None = None
+) -> QuerySet[Block]:
+    """Return space-scoped historical blocks sharing at least one term with the current text."""
+    keys = set(token_ids)
+    if not keys:
+        return Block.objects.none()
+    block_ids = (
+        BlockToken.objects.filter(user=session.user, space=session.space, term_id__in=keys)
+        .exclude(block__document=session.document)
+        .values("block_id")
+    )
+    return _recent_first(block_ids, since)
+
+
+def lsh_candidate_blocks(
+    session: WritingSession, bucket_keys: set[str], since: datetime | None = None
+) -> QuerySet[Block]:
+    """Return space-scoped historical blocks colliding with the current text in any LSH band."""
+    if not bucket_keys:
+        return Block.objects.none()
+    block_ids = (
+        BlockBucket.objects.filter(user=session.user, space=session.space, bucket__in=bucket_keys)
+        .exclude(block__document=session.document)
+        .values("block_id")
+    )
+    return _recent_first(block_ids, since)
+
+
+def vector_candidate_blocks(
+    session: WritingSession, current_blocks: list[Block], since: datetime | None = None
+) -> list[Block]:
+    """Return the nearest historical blocks by vector similarity, found through hyperplane buckets.
+
+    Each current block looks up its own buckets and keeps at most `MARS_VECTOR_MAX_CANDIDATES`
+    colliding blocks, those sharing the most tables first. Only those are compared by cosine,
+    and the block keeps its `MARS_VECTOR_TOP_K` most similar. The union of these top-k lists
+    is returned most recent first.
+    """
+    buckets = BlockBucket.objects.filter(user=session.user, space=session.space).exclude(
+        block__document=session.document
+    )
+    if since:
+        buckets = buckets.filter(block__updated_at__gt=since)
+    cap = getattr(settings, "MARS_VECTOR_MAX_CANDIDATES", 200)
+    shortlists: dict[int, list[int]] = {}
+    for current_block in current_blocks:
+        keys = hyperplane_bucket_keys(current_block.vector_array)
+        if keys:
+            shortlists[current_block.id] = list(
+                buckets.filter(bucket__in=keys)
+                .values("block_id")
+                .annotate(tables=Count("id"))
+                .order_by("-tables", "-block_id")
+                .values_list("block_id", flat=True)[:cap]
             )
-        return None
+    shortlisted = Block.objects.only("id", "vector").in_bulk(
+        {block_id for ids in shortlists.values() for block_id in ids}
+    )
+    top_k = getattr(settings, "MARS_VECTOR_TOP_K", 20)
+    nearest: set[int] = set()
+    for current_block in current_blocks:
+        similarities = [
+            (cosine(current_block.vector_array, shortlisted[block_id].vector_array), block_id)
+            for block_id in shortlists.get(current_block.id, ())
+        ]
+        nearest.update(block_id for similarity, block_id in heapq.nlargest(top_k, similarities) if similarity > 0)
+    return list(Block.objects.filter(id__in=nearest).order_by("-created_at", "-id"))
+
+
+def reachable_documents(session: WritingSession, current_blocks: list[Block]) -> set[int]:
+    """Return ids of the space's other documents whose fingerprint can reach the overlap threshold."""
+    query = FingerprintQuery([block.token_array for block in current_blocks])
+    documents = (
+        Document.objects.filter(user=session.user, space=session.space)
+        .exclude(id=session.document_id)
+        .values_list("id", "fingerprint")
+    )
+    return {document_id for document_id, fingerprint in documents if query.can_reach(bytes(fingerprint))}
+
 
-    prerequisite_terms = {"basics", "foundation", "intro", "introduction", "fundamental"}
-    if overlap > 0.22:
-        return (
-            InsightRelationType.CONCEPTUAL_OVERLAP,
-            overlap,
-            "This concept overlaps with something you already wrote about.",
+def _candidate_blocks(
+    session: WritingSession, current_blocks: list[Block], since: datetime | None = None, fill_cache: bool = False
+) -> list[Block]:
+    """Fetch candidate source blocks from the space cache, or with the configured retrieval strategy.
+
+    A cache hit takes precedence over `MARS_CANDIDATE_RETRIEVAL` and returns every cached
+    block sharing a token with the current blocks, as the "index" strategy would. On a
+    miss the space is only loaded into the cache with `fill_cache`; otherwise this call
+    falls back to the configured retrieval.
+    """
+    if not current_blocks:
+        return []
+    if vector_backend_enabled():
+        # Paraphrases may share no tokens, so lexical document pruning does not apply here.
+        return vector_candidate_blocks(session, current_blocks, since)
+
+    documents = reachable_documents(session, current_blocks)
+    if not documents:
+        return []
+
+    if getattr(settings, "MARS_CANDIDATE_CACHE_ENABLED", True):
+        # created_at guards against a recreated space reusing the id of a deleted one.
+        version = (
+            Document.objects.filter(id=session.document_id)
+            .values_list("space__created_at", "space__blocks_version", "blocks_version")
+            .first()
         )
-    if tokenize(source.text).intersection(prerequisite_terms):
-        return (
-            InsightRelationType.PREREQUISITE_LINK,
-            0.15 + overlap,
-            "A prior foundational note may help with this concept.",
+        if version is not None:
+            created_at, space_version, document_version = version
+            cached = candidate_cache.lookup(
+                session.user_id,
+                session.space_id,
+                (created_at, space_version),
+                session.document_id,
+                document_version,
+                load=fill_cache,
+            )
+            if cached is not None:
+                tokens: set[int] = set()
+                for current_block in current_blocks:
+                    tokens.update(current_block.token_array)
+                matches = cached.matching(tokens, exclude_document_id=session.document_id, since=since)
+                return [candidate for candidate in matches if candidate.document_id in documents]
+    if getattr(settings, "MARS_CANDIDATE_RETRIEVAL", "lsh") == "lsh":
+        bucket_keys: set[str] = set()
+        for current_block in current_blocks:
+            bucket_keys.update(lsh_bucket_keys(unpack_signature(current_block.minhash)))
+        return list(lsh_candidate_blocks(session, bucket_keys, since).filter(document_id__in=documents))
+
+    current_tokens: set[int] = set()
+    for current_block in current_blocks:
+        current_tokens.update(current_block.token_array)
+    # Every relation requires overlap >= 0.12, so blocks sharing no token can never qualify.
+    return list(candidate_blocks_for(session, current_tokens, since).filter(document_id__in=documents))
+
+
+def save_receipt(document: Document, key: str) -> dict[str, Any] | None:
+    """Return the response of an earlier save of `document` under `key`, if still kept."""
+    ttl = timedelta(hours=getattr(settings, "MARS_SAVE_RECEIPT_TTL_HOURS", 24))
+    return (
+        DocumentSaveReceipt.objects.filter(document=document, key=key, created_at__gte=timezone.now() - ttl)
+        .values_list("response", flat=True)
+        .first()
+    )
+
+
+def record_save_receipt(document: Document, key: str, response: dict[str, Any]) -> None:
+    """Keep the response of a keyed save, dropping the document's receipts past the TTL or count bound."""
+    DocumentSaveReceipt.objects.bulk_create(
+        [DocumentSaveReceipt(document=document, key=key, response=response)], ignore_conflicts=True
+    )
+    ttl = timedelta(hours=getattr(settings, "MARS_SAVE_RECEIPT_TTL_HOURS", 24))
+    receipts = DocumentSaveReceipt.objects.filter(document=document)
+    overflow = list(
+        receipts.order_by("-created_at", "-id").values_list("id", flat=True)[
+            getattr(settings, "MARS_SAVE_RECEIPTS_PER_DOCUMENT", 50) :
+        ]
+    )
+    receipts.filter(Q(created_at__lt=timezone.now() - ttl) | Q(id__in=overflow)).delete()
+
+
+class StaleRevisionError(Exception):
+    """Raised when a save is based on a document revision that is no longer current."""
+
+    def __init__(self, revision: int):
+        super().__init__(f"document is at revision {revision}")
+        self.revision = revision
+
+
+class BlockOperationError(ValueError):
+    """Raised for a paragraph operation that does not apply to the document."""
+
+
+def _advance_revision(document: Document, base_revision: int | None) -> None:
+    """Bump the document revision, failing if it moved past `base_revision` (when given)."""
+    documents = Document.objects.filter(id=document.id)
+    if base_revision is not None:
+        documents = documents.filter(revision=base_revision)
+    advanced = documents.update(revision=F("revision") + 1)
+    document.refresh_from_db(fields=["revision"])
+    if not advanced:
+        raise StaleRevisionError(document.revision)
+
+
+def _write_block_changes(
+    session: WritingSession,
+    document: Document,
+    created: list[Block],
+    edited: list[Block],
+    moved: list[Block],
+    removed: list[Block],
+) -> bool:
+    """Apply a batch of block changes and refresh retrieval indexes; return whether blocks changed."""
+    if removed:
+        Block.objects.filter(id__in=[block.id for block in removed]).delete()
+    if moved:
+        Block.objects.bulk_update(moved, ["order_index"], batch_size=500)
+    if edited:
+        Block.objects.bulk_update(edited, ["order_index", "text", "updated_at", *BLOCK_FEATURE_FIELDS], batch_size=500)
+        BlockToken.objects.filter(block__in=edited).delete()
+        BlockBucket.objects.filter(block__in=edited).delete()
+    if created:
+        Block.objects.bulk_create(created, batch_size=500)
+    index_blocks([*edited, *created])
+    if created or edited or removed:
+        Space.objects.filter(id=session.space_id).update(blocks_version=F("blocks_version") + 1)
+        Document.objects.filter(id=document.id).update(blocks_version=F("blocks_version") + 1)
+        return True
+    return False
+
+
+def _set_text(block: Block, text: str, features: dict[str, Any]) -> None:
+    block.text = text
+    for field, value in features.items():
+        setattr(block, field, value)
+    # drop cached arrays so indexing sees the new terms and vector
+    block.__dict__.pop("token_array", None)
+    block.__dict__.pop("vector_array", None)
+    block.updated_at = timezone.now()
+
+
+def sync_document_blocks(
+    session: WritingSession, document: Document, text: str, base_revision: int | None = None
+) -> list[Block]:
+    """Persist document text by diffing its paragraphs against stored blocks.
+
+    Unchanged paragraphs keep their block (and primary key), moved ones only get a new
+    `order_index`, edited paragraphs reuse the block that previously sat at their position
+    (or any other unmatched block), and whatever is left over is deleted. All writes are
+    batched inside one transaction, which also advances `document.revision` (raising
+    `StaleRevisionError` if `base_revision` is given and no longer current).
+    """
+    with transaction.atomic():
+        _advance_revision(document, base_revision)
+        document.content = text
+        document.content_hash = content_hash(text)
+        document.save(update_fields=["content", "content_hash", "updated_at"])
+
+        existing = list(Block.objects.filter(document=document).order_by("order_index"))
+        by_hash: dict[str, list[Block]] = {}
+        for block in existing:
+            by_hash.setdefault(block.content_hash, []).append(block)
+
+        ordered: list[Block | None] = []
+        moved: list[Block] = []
+        # Paragraphs are consumed in batches: matched ones are dropped right away, and only
+        # unmatched ones are kept, together with their features, until blocks are assigned.
+        pending: dict[int, tuple[str, dict[str, Any]]] = {}
+        paragraphs = iter_blocks(text)
+        while batch := list(itertools.islice(paragraphs, SYNC_BATCH_SIZE)):
+            unmatched: list[tuple[int, str]] = []
+            for part in batch:
+                idx = len(ordered)
+                matches = by_hash.get(content_hash(part))
+                block = matches.pop(0) if matches else None
+                if block is None:
+                    unmatched.append((idx, part))
+                elif block.order_index != idx:
+                    block.order_index = idx
+                    moved.append(block)
+                ordered.append(block)
+            features = block_features_batch([part for _, part in unmatched])
+            pending.update((idx, (part, feature)) for (idx, part), feature in zip(unmatched, features))
+
+        matched_ids = {block.id for block in ordered if block}
+        leftovers = {block.order_index: block for block in existing if block.id not in matched_ids}
+        in_place = {idx: leftovers.pop(idx) for idx in pending if idx in leftovers}
+        spare = sorted(leftovers.values(), key=lambda block: block.order_index)
+        created: list[Block] = []
+        edited: list[Block] = []
+        for idx, (part, feature) in pending.items():
+            block = in_place.get(idx) or (spare.pop(0) if spare else None)
+            if block:
+                block.order_index = idx
+                _set_text(block, part, feature)
+                edited.append(block)
+            else:
+                block = Block(
+                    user=session.user,
+                    space=session.space,
+                    document=document,
+                    order_index=idx,
+                    text=part,
+                    **feature,
+                )
+                created.append(block)
+            ordered[idx] = block
+
+        if _write_block_changes(session, document, created, edited, moved, spare):
+            document.fingerprint = document_fingerprint(block.token_array for block in ordered if block)
+            Document.objects.filter(id=document.id).update(fingerprint=document.fingerprint)
+
+    return [block for block in ordered if block]
+
+
+def apply_block_operations(
+    session: WritingSession, document: Document, operations: Sequence[dict[str, Any]], base_revision: int
+) -> list[Block]:
+    """Apply paragraph-level insert/replace/delete operations to a document's stored blocks.
+
+    Operations run in order, each `index` referring to the block list as left by the
+    previous one. Only inserted and replaced paragraphs are segmented and featurized;
+    other blocks at most get a new `order_index`. Fails with `StaleRevisionError` unless
+    `base_revision` is the current revision, and with `BlockOperationError` for an index
+    outside the document.
+    """
+    with transaction.atomic():
+        _advance_revision(document, base_revision)
+        existing = list(
+            Block.objects.filter(document=document)
+            .order_by("order_index")
+            .only("id", "user_id", "space_id", "document_id", "order_index")
         )
-    return None
+        # Each slot is (stored block or None, new text or None when unchanged).
+        slots: list[tuple[Block | None, str | None]] = [(block, None) for block in existing]
+        removed: list[Block] = []
+        for number, operation in enumerate(operations):
+            op, index = operation["op"], operation["index"]
+            upper = len(slots) if op == "insert" else len(slots) - 1
+            if not 0 <= index <= upper:
+                raise BlockOperationError(f"operation {number}: index {index} is outside 0..{upper}")
+            pieces = iter_blocks(operation.get("text", "")) if op != "delete" else iter(())
+            if op == "insert":
+                slots[index:index] = [(None, piece) for piece in pieces]
+                continue
+            block, _ = slots[index]
+            first = next(pieces, None)
+            if first is None:
+                del slots[index]
+                if block:
+                    removed.append(block)
+                continue
+            slots[index : index + 1] = [(block, first), *((None, piece) for piece in pieces)]
+
+        changed_texts = [text for _, text in slots if text is not None]
+        features = iter(block_features_batch(changed_texts))
+        ordered: list[Block] = []
+        created: list[Block] = []
+        edited: list[Block] = []
+        moved: list[Block] = []
+        for idx, (block, text) in enumerate(slots):
+            if text is None:
+                if block.order_index != idx:
+                    block.order_index = idx
+                    moved.append(block)
+            elif block:
+                block.order_index = idx
+                _set_text(block, text, next(features))
+                edited.append(block)
+            else:
+                block = Block(
+                    user=session.user,
+                    space=session.space,
+                    document=document,
+                    order_index=idx,
+                    text=text,
+                    **next(features),
+                )
+                created.append(block)
+            ordered.append(block)
+
+        _write_block_changes(session, document, created, edited, moved, removed)
+        texts = Block.objects.filter(document=document).order_by("order_index").values_list("text", flat=True)
+        document.content = "\n\n".join(texts)
+        document.content_hash = content_hash(document.content)
+        update_fields = ["content", "content_hash", "updated_at"]
+        new_arrays = [block.token_array for block in [*created, *edited]]
+        # Bloom filters only grow: bits left by replaced text cost pruning power, never recall.
+        # A document stored before fingerprints existed keeps none until the next full save.
+        if new_arrays and (document.fingerprint or not existing):
+            document.fingerprint = document_fingerprint(new_arrays, base=bytes(document.fingerprint))
+            update_fields.append("fingerprint")
+        document.save(update_fields=update_fields)
+
+    return ordered
 
 
-def generate_insights_for_session(session: WritingSession) -> list[Insight]:
-    """Regenerate top insight candidates for a writing session from local blocks."""
+def classify_relation(mode: str, current: Block, source: Block) -> tuple[str, float, str] | None:
+    """Classify the semantic relation between current and source blocks for a mode."""
+    if not current.token_count or not source.token_count:
+        return None
+    # Jaccard can never exceed the size ratio of the two sets, so skip hopeless pairs early.
+    if min(current.token_count, source.token_count) / max(current.token_count, source.token_count) < MIN_OVERLAP:
+        return None
+    shared = intersection_size(current.token_array, source.token_array)
+    overlap = shared / (current.token_count + source.token_count - shared)
+    return relation_for_overlap(mode, overlap, current.sentiment_score, source.sentiment_score, source.is_foundational)
+
+
+def generate_insights_for_session(
+    session: WritingSession, time_budget: float | None = None, block_indices: Collection[int] | None = None
+) -> list[Insight]:
+    """Refresh top insight candidates for a writing session from local blocks.
+
+    Only work invalidated since the previous run is redone: current blocks that are new or
+    edited (or whose cited source changed) are scored against every candidate, while
+    untouched blocks are only scored against candidates that appeared since. Insights that
+    are still valid keep their primary key, so their event history stays attached.
+
+    Scoring stops once `time_budget` seconds (default `MARS_INSIGHT_TIME_BUDGET_SECONDS`),
+    counted from before candidate retrieval, have elapsed, keeping the best insights found
+    so far (none if retrieval alone spent the budget). Such runs set
+    `session.insights_partial` and leave the watermark untouched so the next run redoes them.
+
+    With `block_indices`, only the blocks at those positions are scored and only their
+    insights are replaced, so the cost follows the edited paragraphs rather than the
+    document length. Such scoped runs never move the watermark or the partial flag; the
+    next full run still covers every block.
+    """
     if not session.document:
         return []
 
-    session.insights.all().delete()
+    if time_budget is None:
+        time_budget = getattr(settings, "MARS_INSIGHT_TIME_BUDGET_SECONDS", 2.0)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    run_started = timezone.now()
+    since = session.insights_generated_at
 
-    current_blocks: QuerySet[Block] = Block.objects.filter(document=session.document).order_by("order_index")
-    candidate_blocks: QuerySet[Block] = (
-        Block.objects.filter(user=session.user, space=session.space)
-        .exclude(document=session.document)
-        .order_by("-created_at")[:300]
-    )
+    current_query = Block.objects.filter(document=session.document)
+    session_insights = session.insights.all()
+    if block_indices is not None:
+        current_query = current_query.filter(order_index__in=block_indices)
+        session_insights = session_insights.filter(current_block__in=current_query)
+    current_blocks = list(current_query.order_by("order_index"))
+    current_ids = {block.id for block in current_blocks}
+    existing: dict[int, list[Insight]] = {block.id: [] for block in current_blocks}
+    stale: list[Insight] = []
+    for insight in session_insights.select_related("source_block"):
+        if insight.current_block_id in current_ids:
+            existing[insight.current_block_id].append(insight)
+        else:
+            stale.append(insight)
+
+    def needs_full_pass(block: Block) -> bool:
+        if since is None or block.updated_at > since:
+            return True
+        return any(
+            insight.source_block is None or insight.source_block.updated_at > since for insight in existing[block.id]
+        )
+
+    dirty = [block for block in current_blocks if needs_full_pass(block)]
+    dirty_ids = {block.id for block in dirty}
+    clean = [block for block in current_blocks if block.id not in dirty_ids]
+
+    # Candidates are only a shortlist; the ranker re-scores each pair with exact overlap. Only
+    # runs without a deadline are off the typing path, so only they may load a whole space.
+    all_candidates = _candidate_blocks(session, dirty, fill_cache=deadline is None)
+    new_candidates = _candidate_blocks(session, clean, since=since, fill_cache=deadline is None)
+
+    # Memo misses keep every qualifying source (limit None) so the memo can answer later runs alone.
+    memo = PairMemo(session.mode, current_blocks) if pair_memo_enabled() and not vector_backend_enabled() else None
+    ranked: dict[int, list[RankedSource]] = {}
+    pending = []
+    for current_block in dirty:
+        remembered = memo.lookup(current_block, all_candidates) if memo else None
+        if remembered is None:
+            pending.append(current_block)
+        else:
+            ranked[current_block.id] = remembered
+    qualifying: dict[int, list[RankedSource]] = {}
+    partial = False
+    if pending:
+        qualifying, partial = rank_anytime(session.mode, pending, all_candidates, deadline, limit=None if memo else 2)
+    for current_block in pending:
+        if memo and not partial:
+            memo.record(current_block, all_candidates, qualifying[current_block.id])
+        ranked[current_block.id] = qualifying[current_block.id][:2]
+
+    for current_block in clean:
+        if deadline and time.monotonic() >= deadline:
+            partial = True
+            ranked[current_block.id] = [
+                RankedSource(insight.score, insight.source_block, insight.relation_type, insight.reason_text)
+                for insight in existing[current_block.id]
+            ]
+            continue
+        pool = {block.id: block for block in new_candidates}
+        for insight in existing[current_block.id]:
+            pool.setdefault(insight.source_block_id, insight.source_block)
+        sources = sorted(pool.values(), key=lambda block: (block.created_at, block.id), reverse=True)
+        remembered = memo.lookup(current_block, sources) if memo else None
+        if remembered is None:
+            remembered = rank_candidates(session.mode, [current_block], sources, limit=None if memo else 2)[current_block.id]
+            if memo:
+                memo.record(current_block, sources, remembered)
+        ranked[current_block.id] = remembered[:2]
 
     insights: list[Insight] = []
+    created: list[Insight] = []
     for current_block in current_blocks:
-        best_for_current: list[tuple[float, Block, str, str]] = []
-        for source_block in candidate_blocks:
-            classified = classify_relation(session.mode, current_block, source_block)
-            if not classified:
+        previous: dict[int, Insight] = {}
+        for insight in existing[current_block.id]:
+            if insight.source_block_id is None:
+                stale.append(insight)  # its source block was deleted
+            else:
+                previous[insight.source_block_id] = insight
+        for score, source_block, relation_type, reason in ranked[current_block.id]:
+            kept = previous.pop(source_block.id, None)
+            if kept and (kept.relation_type, kept.score, kept.reason_text) == (relation_type, round(score, 4), reason):
+                insights.append(kept)
                 continue
-            relation_type, score, reason = classified
-            best_for_current.append((score, source_block, relation_type, reason))
-
-        best_for_current.sort(key=lambda item: item[0], reverse=True)
-        for score, source_block, relation_type, reason in best_for_current[:2]:
-            insight = Insight.objects.create(
-                session=session,
-                current_block=current_block,
-                source_block=source_block,
-                relation_type=relation_type,
-                reason_text=reason,
-                score=round(score, 4),
+            if kept:
+                stale.append(kept)
+            created.append(
+                Insight(
+                    session=session,
+                    current_block=current_block,
+                    source_block_id=source_block.id,
+                    relation_type=relation_type,
+                    reason_text=reason,
+                    score=round(score, 4),
+                )
             )
-            insights.append(insight)
+        stale.extend(previous.values())
 
+    with transaction.atomic():
+        if stale:
+            Insight.objects.filter(id__in=[insight.id for insight in stale]).delete()
+        Insight.objects.bulk_create(created, batch_size=500)
+        if block_indices is None:
+            if not partial:
+                session.insights_generated_at = run_started
+            session.insights_partial = partial
+            session.save(update_fields=["insights_generated_at", "insights_partial"])
+        if memo:
+            memo.save()
+    insights.extend(created)
     return insights
 
 
@@ -194,7 +830,7 @@ def _average_sentiment(blocks: Iterable[Block]) -> float:
 
 
 def update_journal_post_session_state(user: User, session: WritingSession) -> StreakState:
-    """Update streak state and sentiment snapshot after a journal session finalizes."""
+    """Update streak state and record a sentiment snapshot (and its rollups) after a journal session finalizes."""
     today = timezone.now().date()
     streak, _ = StreakState.objects.get_or_create(user=user)
 
@@ -213,12 +849,14 @@ def update_journal_post_session_state(user: User, session: WritingSession) -> St
         blocks = session.document.blocks.all()
         if blocks.exists():
             avg = _average_sentiment(blocks)
-            SentimentSnapshot.objects.create(
-                user=user,
-                space=session.space,
-                document=session.document,
-                session=session,
-                score=round(avg, 4),
-            )
+            with transaction.atomic():
+                snapshot = SentimentSnapshot.objects.create(
+                    user=user,
+                    space=session.space,
+                    document=session.document,
+                    session=session,
+                    score=round(avg, 4),
+                )
+                record_sentiment(snapshot)
 
     return streak
@@ -1,8 +1,114 @@
 import json
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-from django.test import TestCase
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_migrate
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import scoring
+from .cache import MappedSpaceCandidates, candidate_cache, load_space_candidates
+from .events import event_buffer
+from .fingerprint import (
+    FingerprintQuery,
+    _positions,
+    _term_mask,
+    can_reach_overlap,
+    document_fingerprint,
+    possible_shared_terms,
+)
+from .jobs import claim_next_job, enqueue_insight_job, process_insight_jobs, run_insight_job, run_scoped_insights
+from .lsh import lsh_bucket_keys, minhash_signature
+from .memo import prune_pair_memo
+from .models import (
+    Block,
+    BlockToken,
+    Document,
+    DocumentSaveReceipt,
+    Insight,
+    InsightEvent,
+    InsightEventRollup,
+    InsightEventType,
+    InsightFunnelCounter,
+    InsightJob,
+    InsightJobStatus,
+    Mode,
+    PairScoreMemo,
+    SentimentRollup,
+    SentimentSnapshot,
+    Space,
+    Term,
+    WritingSession,
+)
+from .scoring import rank_anytime, rank_batch, rank_candidates, shutdown_pool
+from .sentiment import record_sentiment
+from .services import (
+    block_features,
+    candidate_blocks_for,
+    classify_relation,
+    clear_lexicon,
+    content_hash,
+    generate_insights_for_session,
+    index_blocks,
+    iter_blocks,
+    jaccard,
+    lexicon,
+    reachable_documents,
+    segment_blocks,
+    sync_document_blocks,
+    tokenize,
+    vector_candidate_blocks,
+)
+from .vocabulary import term_ids
 
+
+class ApiHelpers:
+    """Shortcuts for driving the JSON API through the test client."""
+
+    def _post(self, path, payload):
+        return self.client.post(path, data=json.dumps(payload), content_type='application/json').json()
+
+    def _bootstrap(self):
+        bootstrap = self.client.get('/api/bootstrap').json()
+        return bootstrap['user']['id'], bootstrap['default_space']['id']
+
+    def _learning_session(self, user_id, space_id, title):
+        doc = self._post(
+            '/api/documents', {'user_id': user_id, 'space_id': space_id, 'title': title, 'mode': 'LEARNING'}
+        )['document']
+        session = self._post(
+            '/api/sessions', {'user_id': user_id, 'space_id': space_id, 'document_id': doc['id'], 'mode': 'LEARNING'}
+        )['session']
+        return doc, session
+
+
+class WriterFixtures:
+    """Creates a writer with a personal space and a learning document open in a session."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='writer')
+        self.space = Space.objects.create(user=self.user, name='Personal')
+        self.document, self.session = self._open_document('Now')
+
+    def _open_document(self, title, mode=Mode.LEARNING, space=None):
+        space = space or self.space
+        document = Document.objects.create(user=self.user, space=space, title=title, mode=mode)
+        return document, WritingSession.objects.create(user=self.user, space=space, document=document, mode=mode)
+
+
+@override_settings(MARS_INSIGHT_JOBS_EAGER=True)
 class ApiFlowTests(TestCase):
     def test_learning_mode_generates_overlap_insight(self):
         bootstrap = self.client.get('/api/bootstrap').json()
@@ -158,3 +264,865 @@ class ApiFlowTests(TestCase):
 
         after = self.client.get(f"/api/insights?session_id={current_session['id']}").json()['insights']
         self.assertGreaterEqual(len(after), 1)
+
+
+class CandidateRetrievalTests(WriterFixtures, TestCase):
+    def _block(self, space, text, user=None):
+        user = user or self.user
+        doc = Document.objects.create(user=user, space=space, title='Doc', mode=Mode.LEARNING)
+        block = Block.objects.create(
+            user=user, space=space, document=doc, order_index=0, text=text, **block_features(text)
+        )
+        index_blocks([block])
+        return block
+
+    def test_candidates_share_tokens_and_respect_space_boundary(self):
+        match = self._block(self.space, 'Dynamic programming memoization notes.')
+        self._block(self.space, 'Unrelated gardening diary entry.')
+        other_space = Space.objects.create(user=self.user, name='Work')
+        self._block(other_space, 'Dynamic programming in another space.')
+        other_user = User.objects.create(username='someone')
+        other_user_space = Space.objects.create(user=other_user, name='Personal')
+        self._block(other_user_space, 'Dynamic programming for another user.', user=other_user)
+
+        candidates = candidate_blocks_for(self.session, term_ids(tokenize('Practising dynamic programming today.')).values())
+        self.assertEqual(list(candidates), [match])
+
+    def test_candidates_reach_beyond_recent_history(self):
+        oldest = self._block(self.space, 'Topological sorting of dependency graphs.')
+        for idx in range(310):
+            self._block(self.space, f'Filler paragraph number {idx} about cooking.')
+
+        candidates = candidate_blocks_for(self.session, term_ids(tokenize('Topological ordering revisited.')).values())
+        self.assertIn(oldest, list(candidates))
+
+    def test_reindex_backfills_features_for_existing_rows(self):
+        doc = Document.objects.create(user=self.user, space=self.space, title='Legacy', mode=Mode.LEARNING)
+        legacy = Block.objects.create(
+            user=self.user, space=self.space, document=doc, order_index=0, text='Introduction to recursion basics.'
+        )
+
+        call_command('reindex_blocks', stdout=StringIO())
+
+        legacy.refresh_from_db()
+        self.assertEqual(
+            set(Term.objects.filter(id__in=legacy.token_array).values_list('text', flat=True)),
+            {'basics', 'introduction', 'recursion'},
+        )
+        self.assertEqual(legacy.token_count, 3)
+        self.assertTrue(legacy.is_foundational)
+        self.assertEqual(BlockToken.objects.filter(block=legacy).count(), 3)
+        doc.refresh_from_db()
+        self.assertTrue(can_reach_overlap(bytes(doc.fingerprint), [legacy.token_array]))
+
+    def test_document_fingerprints_prune_unreachable_documents(self):
+        def prior(text):
+            doc, session = self._open_document('Prior')
+            sync_document_blocks(session, doc, text)
+            return doc
+
+        related = prior('Gardening diary.\n\nDynamic programming memoization tabulation.')
+        prior('Gardening diary.\n\nCompost and tomato seedlings.')
+        legacy = Document.objects.create(user=self.user, space=self.space, title='Legacy', mode=Mode.LEARNING)
+        current = sync_document_blocks(self.session, self.document, 'Dynamic programming tabulation notes.')
+
+        self.assertEqual(reachable_documents(self.session, current), {related.id, legacy.id})
+
+
+class MinHashRecallTests(SimpleTestCase):
+    def test_lsh_recall_against_exact_jaccard(self):
+        rng = random.Random(7)
+        vocabulary = [f'term{idx:03d}' for idx in range(240)]
+        topics = [vocabulary[start : start + 30] for start in range(0, 240, 30)]
+
+        def make_block():
+            topic = rng.choice(topics)
+            return set(rng.sample(topic, rng.randint(4, 12))) | set(rng.sample(vocabulary, rng.randint(0, 4)))
+
+        corpus = [make_block() for _ in range(300)]
+        queries = [make_block() for _ in range(30)]
+        corpus_keys = [set(lsh_bucket_keys(minhash_signature(tokens))) for tokens in corpus]
+
+        expected = found = 0
+        for query in queries:
+            query_keys = set(lsh_bucket_keys(minhash_signature(query)))
+            for tokens, keys in zip(corpus, corpus_keys):
+                if jaccard(sorted(query), sorted(tokens)) < 0.12:
+                    continue
+                expected += 1
+                found += bool(query_keys & keys)
+
+        self.assertGreater(expected, 100)
+        self.assertGreaterEqual(found / expected, 0.95)
+
+    def test_fingerprint_positions_do_not_alias_across_the_width(self):
+        fingerprint = document_fingerprint([range(1, 501)], bits=8192)
+        self.assertEqual(possible_shared_terms(fingerprint, range(1, 501)), 500)
+        # Ids congruent modulo the width must not share their filter positions.
+        aliases = [term + 8192 * k for k in range(1, 5) for term in (1, 2, 3, 4, 5)]
+        self.assertLess(possible_shared_terms(fingerprint, aliases), 3)
+        self.assertLess(possible_shared_terms(fingerprint, range(100_000, 102_000)), 40)
+
+    def test_fingerprint_query_hashes_each_term_once(self):
+        fingerprints = [document_fingerprint([range(start, start + 50)]) for start in range(0, 5000, 100)]
+        current = [list(range(20, 60)), list(range(4000, 4030))]
+        _term_mask.cache_clear()
+        with mock.patch('core.fingerprint._positions', wraps=_positions) as positions:
+            query = FingerprintQuery(current)
+            reachable = [index for index, fingerprint in enumerate(fingerprints) if query.can_reach(fingerprint)]
+            self.assertEqual(reachable, [0, 40])
+            self.assertTrue(FingerprintQuery(current).can_reach(fingerprints[40]))
+        self.assertEqual(positions.call_count, 70)
+
+
+class BlockSyncTests(WriterFixtures, TestCase):
+    def test_resave_only_touches_changed_paragraphs(self):
+        first = sync_document_blocks(self.session, self.document, 'Alpha notes.\n\nBravo notes.\n\nCharlie notes.')
+        alpha, bravo, charlie = (block.id for block in first)
+
+        second = sync_document_blocks(self.session, self.document, 'Charlie notes.\n\nAlpha notes.\n\nDelta edited.')
+
+        self.assertEqual([block.id for block in second[:2]], [charlie, alpha])
+        self.assertEqual(second[2].id, bravo)
+        stored = list(Block.objects.filter(document=self.document).order_by('order_index'))
+        self.assertEqual([block.text for block in stored], ['Charlie notes.', 'Alpha notes.', 'Delta edited.'])
+        self.assertEqual(stored[2].token_count, 2)
+        self.assertEqual(
+            set(BlockToken.objects.filter(block_id=bravo).values_list('term__text', flat=True)), {'delta', 'edited'}
+        )
+
+    def test_paragraphs_are_matched_across_batches(self):
+        first = sync_document_blocks(self.session, self.document, '\n\n'.join(f'Note {word}.' for word in 'abcde'))
+        ids = {block.text: block.id for block in first}
+
+        with mock.patch('core.services.SYNC_BATCH_SIZE', 2):
+            second = sync_document_blocks(
+                self.session, self.document, 'Note e.\n\nNote b.\n\nNote x.\n\nNote a.\n\nNote y.\n\nNote c.'
+            )
+
+        self.assertEqual([block.text for block in second], ['Note e.', 'Note b.', 'Note x.', 'Note a.', 'Note y.', 'Note c.'])
+        self.assertEqual([block.id for block in second[:2]], [ids['Note e.'], ids['Note b.']])
+        self.assertEqual(second[2].id, ids['Note d.'])
+        self.assertEqual([block.order_index for block in second], list(range(6)))
+        self.assertEqual(Block.objects.filter(document=self.document).count(), 6)
+
+    def test_lexicon_registers_missing_words_and_resets_after_migrate(self):
+        self.addCleanup(clear_lexicon)  # ids created here are rolled back with the test
+        Term.objects.filter(text='basics').delete()
+        clear_lexicon()
+
+        block = sync_document_blocks(self.session, self.document, 'Recursion basics.')[0]
+        self.assertTrue(block.is_foundational)
+        self.assertIn(Term.objects.get(text='basics').id, lexicon().prerequisite)
+
+        cached = lexicon()
+        post_migrate.send(sender=apps.get_app_config('core'), app_config=apps.get_app_config('core'))
+        self.assertIsNot(lexicon(), cached)
+        self.assertEqual(lexicon(), cached)
+
+    def test_removed_paragraphs_are_deleted(self):
+        sync_document_blocks(self.session, self.document, 'Alpha notes.\n\nBravo notes.')
+
+        remaining = sync_document_blocks(self.session, self.document, 'Bravo notes.')
+
+        self.assertEqual([block.text for block in remaining], ['Bravo notes.'])
+        self.assertEqual(Block.objects.filter(document=self.document).count(), 1)
+
+    def test_delta_save_applies_paragraph_operations(self):
+        def save(payload):
+            return self.client.post(
+                f'/api/documents/{self.document.id}/blocks',
+                data=json.dumps({'session_id': self.session.id, **payload}),
+                content_type='application/json',
+            )
+
+        saved = save({'text': 'Alpha notes.\n\nBravo notes.\n\nCharlie notes.'}).json()
+        alpha, bravo, charlie = Block.objects.filter(document=self.document).order_by('order_index')
+        self.assertEqual(saved['revision'], 1)
+
+        operations = [
+            {'op': 'replace', 'index': 1, 'text': 'Bravo edited.'},
+            {'op': 'insert', 'index': 0, 'text': 'Intro notes.'},
+            {'op': 'delete', 'index': 3},
+        ]
+        saved = save({'base_revision': 1, 'operations': operations}).json()
+
+        stored = list(Block.objects.filter(document=self.document).order_by('order_index'))
+        self.assertEqual(saved['revision'], 2)
+        self.assertEqual([block.text for block in stored], ['Intro notes.', 'Alpha notes.', 'Bravo edited.'])
+        self.assertEqual([block.id for block in stored[1:]], [alpha.id, bravo.id])
+        self.assertFalse(Block.objects.filter(id=charlie.id).exists())
+        self.assertEqual(
+            set(BlockToken.objects.filter(block_id=bravo.id).values_list('term__text', flat=True)), {'bravo', 'edited'}
+        )
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'Intro notes.\n\nAlpha notes.\n\nBravo edited.')
+
+        stale = save({'base_revision': 1, 'operations': [{'op': 'delete', 'index': 0}]})
+        self.assertEqual((stale.status_code, stale.json()['revision']), (409, 2))
+        outside = save({'base_revision': 2, 'operations': [{'op': 'replace', 'index': 3, 'text': 'Nope.'}]})
+        self.assertEqual(outside.status_code, 400)
+        self.assertEqual(Block.objects.filter(document=self.document).count(), 3)
+
+    def test_unchanged_and_retried_saves_are_noops(self):
+        def save(payload, **headers):
+            return self.client.post(
+                f'/api/documents/{self.document.id}/blocks',
+                data=json.dumps({'session_id': self.session.id, **payload}),
+                content_type='application/json',
+                **headers,
+            ).json()
+
+        first = save({'text': 'Alpha notes.\n\nBravo notes.'}, HTTP_IDEMPOTENCY_KEY='save-1')
+        self.assertFalse(first['noop'])
+
+        with CaptureQueriesContext(connection) as queries:
+            repeat = save({'text': '  Alpha notes.\n\nBravo notes.\n'})
+            retry = save({'text': 'Alpha notes changed.'}, HTTP_IDEMPOTENCY_KEY='save-1')
+        writes = [query['sql'] for query in queries if not query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertTrue(repeat['noop'] and retry['noop'])
+        self.assertEqual((repeat['revision'], repeat['job_id']), (first['revision'], first['job_id']))
+
+        edited = save({'text': 'Alpha notes changed.'}, HTTP_IDEMPOTENCY_KEY='save-2')
+        self.assertFalse(edited['noop'])
+        self.assertEqual(edited['revision'], first['revision'] + 1)
+        self.assertTrue(save({'base_revision': edited['revision'], 'operations': []})['noop'])
+
+    @override_settings(MARS_SAVE_RECEIPTS_PER_DOCUMENT=2)
+    def test_late_retry_of_an_earlier_save_is_replayed(self):
+        def save(text, key):
+            return self.client.post(
+                f'/api/documents/{self.document.id}/blocks',
+                data=json.dumps({'session_id': self.session.id, 'text': text}),
+                content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY=key,
+            ).json()
+
+        first = save('Version A text.', 'k1')
+        save('Version B text.', 'k2')
+        retry = save('Version A text.', 'k1')
+
+        self.assertTrue(retry['noop'])
+        self.assertEqual(retry['job_id'], first['job_id'])
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'Version B text.')
+
+        save('Version C text.', 'k3')
+        self.assertEqual(
+            set(DocumentSaveReceipt.objects.filter(document=self.document).values_list('key', flat=True)), {'k2', 'k3'}
+        )
+
+
+class SegmenterTests(SimpleTestCase):
+    def test_paragraphs_match_blank_line_split(self):
+        text = '  First paragraph\nstill first.\n \t\n\nSecond one.\r\n\r\nThird.  \n'
+        self.assertEqual(segment_blocks(text), ['First paragraph\nstill first.', 'Second one.', 'Third.'])
+        self.assertEqual(segment_blocks(' \n\n '), [])
+
+    def test_overlong_paragraphs_split_at_sentences(self):
+        sentence = 'Recursion needs a base case. '
+        blocks = list(iter_blocks(sentence * 10 + 'Tail', limit=70))
+        self.assertEqual(blocks[0], (sentence * 2).strip())
+        self.assertTrue(all(len(block) <= 70 for block in blocks))
+        self.assertEqual(' '.join(blocks), (sentence * 10 + 'Tail'))
+
+        self.assertEqual(list(iter_blocks('word ' * 5, limit=12)), ['word word', 'word word', 'word'])
+        self.assertEqual(list(iter_blocks('x' * 25, limit=10)), ['x' * 10, 'x' * 10, 'x' * 5])
+
+    def test_pieces_never_start_with_or_consist_of_whitespace(self):
+        self.assertEqual(list(iter_blocks('abcd.      efgh', limit=5)), ['abcd.', 'efgh'])
+        blocks = list(iter_blocks('lorem ipsum  ' * 400))
+        self.assertGreater(len(blocks), 1)
+        self.assertTrue(all(block and block == block.strip() for block in blocks))
+        self.assertEqual(' '.join(blocks).split(), ('lorem ipsum ' * 400).split())
+
+    def test_string_input_is_not_copied(self):
+        text = 'Recursion needs a base case.\n\n' * 100_000
+        tracemalloc.start()
+        try:
+            blocks = iter_blocks(text)
+            self.assertEqual(next(blocks), 'Recursion needs a base case.')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, len(text) // 10)
+
+    def test_accepts_a_stream_of_lines(self):
+        lines = iter(['Alpha line.\n', '\n', 'Beta line.\n'])
+        self.assertEqual(list(iter_blocks(lines)), ['Alpha line.', 'Beta line.'])
+
+
+class IncrementalInsightTests(WriterFixtures, TestCase):
+    def _prior(self, text):
+        doc, session = self._open_document('Prior')
+        return sync_document_blocks(session, doc, text)[0]
+
+    def test_unchanged_pairs_keep_their_insight_ids(self):
+        self._prior('Graph traversal with depth first search.')
+        self._prior('Binary heaps keep priority queues ordered.')
+        sync_document_blocks(
+            self.session,
+            self.document,
+            'Depth first search explores graph traversal paths.\n\nPriority queues rely on binary heaps.',
+        )
+        first = {insight.current_block.order_index: insight for insight in generate_insights_for_session(self.session)}
+        event = InsightEvent.objects.create(insight=first[0], event_type=InsightEventType.INSIGHT_SHOWN)
+
+        sync_document_blocks(
+            self.session,
+            self.document,
+            'Depth first search explores graph traversal paths.\n\nPriority queues rely on binary heaps and sifting.',
+        )
+        second = {insight.current_block.order_index: insight for insight in generate_insights_for_session(self.session)}
+
+        self.assertEqual(second[0].id, first[0].id)
+        self.assertNotEqual(second[1].id, first[1].id)
+        self.assertTrue(InsightEvent.objects.filter(id=event.id).exists())
+
+    def test_new_candidates_reach_untouched_blocks(self):
+        sync_document_blocks(self.session, self.document, 'Dynamic programming tabulation notes.')
+        self.assertEqual(generate_insights_for_session(self.session), [])
+
+        source = self._prior('Dynamic programming memoization tabulation.')
+        insights = generate_insights_for_session(self.session)
+
+        self.assertEqual([insight.source_block_id for insight in insights], [source.id])
+
+    def test_deleting_a_source_document_drops_all_its_insights(self):
+        prior = self._prior('Graph traversal with depth first search.\n\nDepth first search graph traversal order.')
+        sync_document_blocks(self.session, self.document, 'Depth first search explores graph traversal paths.')
+        self.assertEqual(len(generate_insights_for_session(self.session)), 2)
+
+        prior.document.delete()
+        insights = generate_insights_for_session(self.session)
+
+        self.assertEqual(insights, [])
+        self.assertFalse(Insight.objects.filter(session=self.session).exists())
+
+    @override_settings(MARS_ANYTIME_CHUNK_PAIRS=100)
+    def test_time_budget_returns_partial_results_and_keeps_watermark(self):
+        self._prior('\n\n'.join(f'Recursion base case stack frame note {i}.' for i in range(300)))
+        sync_document_blocks(self.session, self.document, 'Recursion needs a base case and a stack frame.')
+
+        self.assertEqual(generate_insights_for_session(self.session, time_budget=1e-9), [])
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.insights_partial)
+
+        # The clock runs out after the first chunk of 100 candidates has been scored.
+        ticks = iter([0.0, 0.0, 1.0])
+        with mock.patch('time.monotonic', side_effect=lambda: next(ticks, 10.0)), mock.patch(
+            'core.scoring.rank_candidates', wraps=rank_candidates
+        ) as ranker:
+            partial = generate_insights_for_session(self.session, time_budget=0.5)
+        self.session.refresh_from_db()
+        self.assertEqual(ranker.call_count, 1)
+        self.assertEqual(len(partial), 2)
+        self.assertTrue(self.session.insights_partial)
+        self.assertIsNone(self.session.insights_generated_at)
+
+        complete = generate_insights_for_session(self.session, time_budget=0)
+        self.session.refresh_from_db()
+        self.assertEqual(len(complete), 2)
+        self.assertFalse(self.session.insights_partial)
+        self.assertIsNotNone(self.session.insights_generated_at)
+
+    def test_scoped_run_only_touches_active_blocks(self):
+        self._prior('Graph traversal with depth first search.')
+        self._prior('Binary heaps keep priority queues ordered.')
+        blocks = sync_document_blocks(
+            self.session,
+            self.document,
+            'Depth first search explores graph traversal paths.\n\nPriority queues rely on binary heaps.',
+        )
+
+        scoped = generate_insights_for_session(self.session, block_indices=[1])
+        self.session.refresh_from_db()
+        self.assertEqual({insight.current_block_id for insight in scoped}, {blocks[1].id})
+        self.assertIsNone(self.session.insights_generated_at)
+
+        full = generate_insights_for_session(self.session)
+        self.assertEqual({insight.current_block_id for insight in full}, {blocks[0].id, blocks[1].id})
+        self.assertTrue({insight.id for insight in scoped} <= {insight.id for insight in full})
+
+
+class PairMemoTests(WriterFixtures, TestCase):
+    def _session(self, text, mode=Mode.JOURNAL):
+        doc, session = self._open_document('Entry', mode)
+        sync_document_blocks(session, doc, text)
+        return session
+
+    def _outcomes(self, insights):
+        return [(insight.source_block_id, insight.relation_type, insight.score) for insight in insights]
+
+    def test_repeated_paragraphs_are_answered_from_the_memo(self):
+        self._session('Work stress again today, tired and anxious about deadlines.')
+        self._session('Calm focused morning, work deadlines felt great.')
+        session = self._session('Work deadlines make me anxious.')
+        first = self._outcomes(generate_insights_for_session(session))
+
+        def resumed():
+            return WritingSession.objects.create(
+                user=self.user, space=self.space, document=session.document, mode=Mode.JOURNAL
+            )
+
+        with mock.patch('core.scoring.rank_batch', wraps=rank_batch) as ranker:
+            second = self._outcomes(generate_insights_for_session(resumed()))
+        self.assertEqual(ranker.call_count, 0)
+        self.assertEqual(second, first)
+        self.assertEqual(PairScoreMemo.objects.count(), 1)
+
+        with mock.patch('core.memo.HEURISTIC_VERSION', 2), mock.patch('core.scoring.rank_batch', wraps=rank_batch) as ranker:
+            third = self._outcomes(generate_insights_for_session(resumed()))
+        self.assertEqual(ranker.call_count, 1)
+        self.assertEqual(third, first)
+        with mock.patch('core.memo.HEURISTIC_VERSION', 2):
+            call_command('prune_pair_memo', stdout=StringIO())
+        self.assertEqual(list(PairScoreMemo.objects.values_list('heuristic_version', flat=True)), [2])
+
+    @override_settings(MARS_PAIR_MEMO_MAX_ENTRIES=1)
+    def test_memo_keeps_most_recently_used_rows(self):
+        self._session('Graph traversal with depth first search.', Mode.LEARNING)
+        generate_insights_for_session(self._session('Depth first search graph traversal.', Mode.LEARNING))
+        generate_insights_for_session(self._session('Graph traversal using depth first search.', Mode.LEARNING))
+        self.assertEqual(PairScoreMemo.objects.count(), 2)
+
+        call_command('prune_pair_memo', stdout=StringIO())
+
+        self.assertEqual(
+            list(PairScoreMemo.objects.values_list('current_hash', flat=True)),
+            [content_hash('Graph traversal using depth first search.')],
+        )
+
+    def test_memo_is_bounded_by_evaluated_bytes(self):
+        for i in range(3):
+            self._session(f'Graph traversal with depth first search, variant {i}.', Mode.LEARNING)
+        with override_settings(MARS_PAIR_MEMO_MAX_SOURCES=2):
+            generate_insights_for_session(self._session('Depth first search graph traversal.', Mode.LEARNING))
+        self.assertFalse(PairScoreMemo.objects.exists())
+
+        generate_insights_for_session(self._session('Graph traversal with depth first search.', Mode.LEARNING))
+        generate_insights_for_session(self._session('Graph traversal using depth first search.', Mode.LEARNING))
+        older, latest = PairScoreMemo.objects.order_by('last_used_at', 'id')
+        self.assertEqual((len(older.evaluated), len(latest.evaluated)), (8 * 4, 8 * 5))
+
+        with override_settings(MARS_PAIR_MEMO_MAX_BYTES=8 * 5 + 8 * 4 - 1):
+            prune_pair_memo()
+        self.assertEqual(list(PairScoreMemo.objects.values_list('id', flat=True)), [latest.id])
+
+
+@override_settings(MARS_SIMILARITY_BACKEND='vector')
+class VectorBackendTests(WriterFixtures, TestCase):
+    def _session(self, text):
+        doc, session = self._open_document('Doc')
+        return session, sync_document_blocks(session, doc, text)
+
+    # A permissive index, so the loose paraphrase (cosine ~0.4) is retrieved and the scoring path is exercised.
+    @override_settings(MARS_VECTOR_HASH_BITS=6)
+    def test_vector_backend_links_inflected_paraphrases(self):
+        _, (source,) = self._session('Sorting algorithms compare elements.')
+        self._session('Gardening tomatoes in raised beds.')
+        session, (current,) = self._session('Sorted algorithm comparing elements.')
+        self.assertIsNone(classify_relation(Mode.LEARNING, current, source))
+
+        insights = generate_insights_for_session(session)
+
+        self.assertEqual([insight.source_block_id for insight in insights], [source.id])
+        self.assertEqual(len(current.vector_array), 128)
+
+    @override_settings(MARS_VECTOR_MAX_CANDIDATES=2, MARS_VECTOR_TOP_K=1)
+    def test_each_block_keeps_its_own_top_k_from_capped_candidates(self):
+        sorting = [self._session('Sorting algorithms compare elements.')[1][0] for _ in range(4)]
+        gardening = self._session('Gardening tomatoes in raised beds.')[1][0]
+        session, current = self._session('Sorting algorithms compare elements.\n\nGardening tomatoes in raised beds.')
+
+        nearest = vector_candidate_blocks(session, current)
+
+        self.assertEqual(nearest, [gardening, sorting[-1]])
+
+
+class InsightJobQueueTests(ApiHelpers, WriterFixtures, TestCase):
+    def test_save_returns_job_that_worker_completes(self):
+        user_id, space_id = self._bootstrap()
+        prior_doc, prior_session = self._learning_session(user_id, space_id, 'Prior')
+        self._post(
+            f"/api/documents/{prior_doc['id']}/blocks",
+            {'session_id': prior_session['id'], 'text': 'Graph traversal uses depth first search.'},
+        )
+        doc, session = self._learning_session(user_id, space_id, 'Current')
+
+        saved = self._post(
+            f"/api/documents/{doc['id']}/blocks",
+            {'session_id': session['id'], 'text': 'Depth first search for graph traversal practice.'},
+        )
+        self.assertEqual(saved['job_status'], 'PENDING')
+        pending = self.client.get(f"/api/insight-jobs/{saved['job_id']}").json()['job']
+        self.assertEqual(pending['status'], 'PENDING')
+        self.assertEqual(self.client.get(f"/api/insights?session_id={session['id']}").json()['insights'], [])
+
+        self.assertGreaterEqual(process_insight_jobs(), 1)
+
+        done = self.client.get(f"/api/insight-jobs/{saved['job_id']}").json()['job']
+        self.assertEqual(done['status'], 'DONE')
+        self.assertGreaterEqual(done['insight_count'], 1)
+
+    def test_active_blocks_are_scored_inline(self):
+        user_id, space_id = self._bootstrap()
+        prior_doc, prior_session = self._learning_session(user_id, space_id, 'Prior')
+        self._post(
+            f"/api/documents/{prior_doc['id']}/blocks",
+            {'session_id': prior_session['id'], 'text': 'Graph traversal uses depth first search.'},
+        )
+        doc, session = self._learning_session(user_id, space_id, 'Current')
+
+        saved = self._post(
+            f"/api/documents/{doc['id']}/blocks",
+            {
+                'session_id': session['id'],
+                'text': 'Unrelated opening line.\n\nDepth first search for graph traversal practice.',
+                'active_blocks': [1],
+            },
+        )
+        self.assertIsNone(saved['job_id'])
+        self.assertEqual(saved['insight_count'], 1)
+        self.assertIn('graph traversal', saved['insights'][0]['current_text'])
+        self.assertEqual(saved['insights'][0]['current_block_id'], saved['active_block_ids'][0])
+        self._post(
+            f"/api/documents/{doc['id']}/blocks",
+            {
+                'session_id': session['id'],
+                'text': 'Unrelated opening line.\n\nDepth first search for graph traversal drills.',
+                'active_blocks': [1],
+            },
+        )
+        self.assertFalse(InsightJob.objects.filter(session_id=session['id']).exists())
+
+        final = self._post(
+            f"/api/documents/{doc['id']}/blocks",
+            {'session_id': session['id'], 'text': 'Depth first search for graph traversal practice.', 'finalize': True},
+        )
+        self.assertEqual(final['job_status'], 'PENDING')
+
+    @override_settings(MARS_INSIGHT_TIME_BUDGET_SECONDS=1e-9)
+    def test_queued_runs_ignore_the_time_budget(self):
+        prior, prior_session = self._open_document('Prior')
+        sync_document_blocks(prior_session, prior, 'Graph traversal with depth first search.')
+        sync_document_blocks(self.session, self.document, 'Depth first search graph traversal.')
+
+        job = enqueue_insight_job(self.session)
+        process_insight_jobs()
+
+        job.refresh_from_db()
+        self.session.refresh_from_db()
+        self.assertEqual((job.status, job.partial, job.insight_count), (InsightJobStatus.DONE, False, 1))
+        self.assertFalse(self.session.insights_partial)
+
+    def test_overlapping_requests_coalesce_into_one_trailing_run(self):
+        session = self.session
+        sync_document_blocks(session, self.document, 'Graph traversal notes.')
+
+        queued = enqueue_insight_job(session)
+        self.assertEqual(enqueue_insight_job(session).id, queued.id)
+
+        running = claim_next_job()
+        trailing = enqueue_insight_job(session)
+        self.assertEqual(enqueue_insight_job(session).id, trailing.id)
+        self.assertNotEqual(trailing.id, running.id)
+        self.assertIsNone(claim_next_job())
+        self.assertIsNone(run_scoped_insights(session, [0]))
+
+        run_insight_job(running)
+        self.assertEqual(process_insight_jobs(), 1)
+        self.assertEqual(
+            list(InsightJob.objects.filter(session=session).values_list('status', flat=True)),
+            [InsightJobStatus.DONE, InsightJobStatus.DONE],
+        )
+
+
+class BatchScorerParityTests(TestCase):
+    def _corpus(self):
+        rng = random.Random(11)
+        words = [
+            'graph', 'search', 'depth', 'queue', 'stack', 'heap', 'tree', 'node', 'edge', 'path',
+            'happy', 'calm', 'progress', 'stuck', 'anxious', 'confused', 'basics', 'introduction',
+        ]
+
+        def make_block(block_id):
+            text = ' '.join(rng.sample(words, rng.randint(2, 8)))
+            return Block(id=block_id, text=text, **block_features(text))
+
+        return [make_block(idx) for idx in range(1, 16)], [make_block(idx) for idx in range(100, 220)]
+
+    def test_batch_ranking_matches_pairwise_classification(self):
+        current_blocks, candidates = self._corpus()
+
+        for mode in (Mode.JOURNAL, Mode.LEARNING):
+            batch = rank_batch(mode, current_blocks, candidates)
+            for current in current_blocks:
+                expected = []
+                for source in candidates:
+                    classified = classify_relation(mode, current, source)
+                    if classified:
+                        relation_type, score, reason = classified
+                        expected.append((score, source.id, relation_type, reason))
+                expected.sort(key=lambda item: item[0], reverse=True)
+                actual = [(item.score, item.source.id, item.relation_type, item.reason) for item in batch[current.id]]
+                self.assertEqual(actual, expected[:2])
+
+    @override_settings(MARS_PARALLEL_SCORING_MIN_PAIRS=1, MARS_SCORING_WORKERS=2, MARS_ANYTIME_CHUNK_PAIRS=300)
+    def test_parallel_ranking_matches_serial(self):
+        self.addCleanup(shutdown_pool)
+        current_blocks, candidates = self._corpus()
+
+        def flatten(ranked):
+            return {key: [(item.score, item.source.id, item.relation_type) for item in value] for key, value in ranked.items()}
+
+        for mode in (Mode.JOURNAL, Mode.LEARNING):
+            for currents in (current_blocks, current_blocks[:1]):
+                serial = rank_batch(mode, currents, candidates)
+                parallel = rank_candidates(mode, currents, candidates)
+                self.assertEqual(flatten(parallel), flatten(serial))
+
+            with mock.patch('core.scoring._executor', wraps=scoring._executor) as executor:
+                anytime, partial = rank_anytime(mode, current_blocks, candidates, time.monotonic() + 60)
+            self.assertFalse(partial)
+            self.assertGreater(executor.call_count, 1)
+            self.assertEqual(flatten(anytime), flatten(rank_batch(mode, current_blocks, candidates)))
+
+
+class CandidateCacheTests(WriterFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        candidate_cache.clear()
+        prior_doc, self.prior_session = self._open_document('Prior')
+        sync_document_blocks(self.prior_session, prior_doc, 'Graph traversal with depth first search.')
+
+    def test_own_document_saves_keep_the_cache_and_other_saves_invalidate(self):
+        sync_document_blocks(self.session, self.document, 'Depth first search graph traversal.')
+        generate_insights_for_session(self.session, time_budget=0)
+        self.assertEqual((candidate_cache.hits, candidate_cache.misses), (0, 1))
+
+        for text in ('Depth first search graph traversal.', 'Breadth first search graph traversal.'):
+            sync_document_blocks(self.session, self.document, text)
+            insights = generate_insights_for_session(self.session, time_budget=0)
+        self.assertEqual((candidate_cache.hits, candidate_cache.misses), (2, 1))
+        self.assertEqual(len(insights), 1)
+
+        sync_document_blocks(self.prior_session, self.prior_session.document, 'Graph traversal with breadth first search.')
+        sync_document_blocks(self.session, self.document, 'Breadth first search graph traversal again.')
+        insights = generate_insights_for_session(self.session, time_budget=0)
+        self.assertEqual((candidate_cache.hits, candidate_cache.misses), (2, 2))
+        self.assertIn('breadth', insights[0].source_block.text)
+
+        stats = self.client.get('/api/metrics/candidate-cache').json()['candidate_cache']
+        self.assertEqual(stats['misses'], 2)
+
+    def test_deadline_bound_miss_uses_indexed_retrieval(self):
+        sync_document_blocks(self.session, self.document, 'Depth first search graph traversal.')
+
+        insights = generate_insights_for_session(self.session)
+
+        self.assertEqual(len(insights), 1)
+        self.assertEqual(candidate_cache.stats()['spaces'], 0)
+        generate_insights_for_session(self.session, time_budget=0)
+        self.assertEqual(candidate_cache.stats()['spaces'], 1)
+
+    @override_settings(MARS_CANDIDATE_CACHE_MAX_TOKENS=12)
+    def test_memory_cap_evicts_least_recently_used_space(self):
+        other_space = Space.objects.create(user=self.user, name='Work')
+        other_doc, other_session = self._open_document('Work', space=other_space)
+        sync_document_blocks(other_session, other_doc, 'Quarterly planning review meeting.')
+        notes_doc, notes_session = self._open_document('Notes', space=other_space)
+        sync_document_blocks(notes_session, notes_doc, 'Quarterly planning review notes.')
+
+        sync_document_blocks(self.session, self.document, 'Depth first search graph traversal.')
+        generate_insights_for_session(self.session, time_budget=0)
+        generate_insights_for_session(other_session, time_budget=0)
+
+        self.assertEqual(candidate_cache.evictions, 1)
+        self.assertLessEqual(candidate_cache.stats()['size'], 12)
+
+    def test_feature_store_matches_in_memory_candidates(self):
+        sync_document_blocks(self.session, self.document, 'Depth first search graph traversal.')
+        tokens = set(Block.objects.get(document=self.document).token_array)
+        version = Space.objects.filter(id=self.space.id).values_list('created_at', 'blocks_version').first()
+        expected = load_space_candidates(self.user.id, self.space.id, version).matching(tokens, self.document.id)
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(MARS_FEATURE_STORE_DIR=directory):
+            mapped = load_space_candidates(self.user.id, self.space.id, version)
+            self.assertIsInstance(mapped, MappedSpaceCandidates)
+            self.assertEqual(mapped.matching(tokens, self.document.id), expected)
+            self.assertEqual(mapped.matching(tokens, self.document.id, since=expected[0].updated_at), [])
+
+            path = Path(directory) / f'{self.user.id}-{self.space.id}.features'
+            inode = path.stat().st_ino
+            load_space_candidates(self.user.id, self.space.id, version)
+            self.assertEqual(path.stat().st_ino, inode)
+
+            load_space_candidates(self.user.id, self.space.id, (version[0], version[1] + 1))
+            self.assertNotEqual(path.stat().st_ino, inode)
+            self.assertEqual(mapped.matching(tokens, self.document.id), expected)
+
+
+@override_settings(MARS_INSIGHT_JOBS_EAGER=True)
+class BulkWriteTests(ApiHelpers, TestCase):
+    def _save_queries(self, user_id, space_id, paragraphs):
+        doc, session = self._learning_session(user_id, space_id, 'Notes')
+        text = '\n\n'.join(f'Graph traversal note {idx}/{paragraphs} about depth first search.' for idx in range(paragraphs))
+        candidate_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            saved = self._post(f"/api/documents/{doc['id']}/blocks", {'session_id': session['id'], 'text': text})
+        self.assertEqual(saved['block_count'], paragraphs)
+        return len(queries), saved['insight_count']
+
+    def test_save_query_count_does_not_grow_with_paragraphs(self):
+        user_id, space_id = self._bootstrap()
+        self._save_queries(user_id, space_id, 3)
+
+        small_queries, small_insights = self._save_queries(user_id, space_id, 2)
+        large_queries, large_insights = self._save_queries(user_id, space_id, 6)
+
+        self.assertEqual(small_insights, 4)
+        self.assertEqual(large_insights, 12)
+        self.assertEqual(small_queries, large_queries)
+
+
+class SentimentTrendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='writer')
+        self.spaces = [Space.objects.create(user=self.user, name=name) for name in ('Personal', 'Work')]
+        self.first_day = timezone.now() - timedelta(days=59)
+        for day in range(60):
+            snapshot = SentimentSnapshot.objects.create(user=self.user, space=self.spaces[day % 2], score=day / 100)
+            SentimentSnapshot.objects.filter(id=snapshot.id).update(created_at=self.first_day + timedelta(days=day))
+            record_sentiment(SentimentSnapshot.objects.get(id=snapshot.id))
+
+    def _trend(self, **params):
+        query = {'user_id': self.user.id, 'start': self.first_day.date().isoformat(), **params}
+        return self.client.get('/api/sentiment/trend', query).json()
+
+    def test_trend_reads_rollups_and_downsamples(self):
+        self.assertEqual(SentimentRollup.objects.filter(period='DAY').count(), 60)
+
+        daily = self._trend(points=100)
+        self.assertEqual((daily['period'], len(daily['points'])), ('DAY', 60))
+        self.assertEqual(daily['points'][-1]['mean'], 0.59)
+
+        coarse = self._trend(points=9)
+        self.assertEqual(coarse['period'], 'WEEK')
+        self.assertLessEqual(len(coarse['points']), 9)
+        self.assertEqual(sum(point['count'] for point in coarse['points']), 60)
+        self.assertEqual((coarse['points'][0]['min'], coarse['points'][-1]['max']), (0.0, 0.59))
+
+        work = self._trend(points=100, space_id=self.spaces[1].id)
+        self.assertEqual([point['mean'] for point in work['points'][:2]], [0.01, 0.03])
+
+    def test_compaction_keeps_trends(self):
+        before = self._trend(points=10)
+        call_command('compact_sentiment_snapshots', older_than_days=0, stdout=StringIO())
+        self.assertFalse(SentimentSnapshot.objects.exists())
+        self.assertEqual(self._trend(points=10), before)
+
+
+class InsightEventBatchTests(WriterFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.insights = [
+            Insight.objects.create(session=self.session, relation_type='REPETITION', reason_text='Seen before.')
+            for _ in range(2)
+        ]
+
+    def _report_shown(self, insight_ids):
+        events = [
+            {'insight_id': insight_id, 'event_type': 'INSIGHT_SHOWN', 'session_id': self.session.id}
+            for insight_id in insight_ids
+        ]
+        return self.client.post('/api/insight-events', data=json.dumps({'events': events}), content_type='application/json')
+
+    def test_batch_is_validated_and_inserted_in_bulk(self):
+        ids = [insight.id for insight in self.insights]
+        with CaptureQueriesContext(connection) as queries:
+            response = self._report_shown([*ids, ids[0], 999999])
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "core_insightevent"')]
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'accepted': 3, 'rejected': [999999]})
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(InsightEvent.objects.filter(session=self.session).count(), 3)
+
+    def test_funnel_counters_follow_events_and_rebuild(self):
+        ids = [insight.id for insight in self.insights]
+        self._report_shown(ids)
+        for insight_id, event_type in ((ids[0], 'INSIGHT_OPENED'), (ids[0], 'INSIGHT_MARKED_USEFUL'), (ids[1], 'INSIGHT_DISMISSED')):
+            self.client.post(
+                f'/api/insights/{insight_id}/events',
+                data=json.dumps({'event_type': event_type, 'session_id': self.session.id}),
+                content_type='application/json',
+            )
+
+        query = {'user_id': self.session.user_id, 'mode': 'LEARNING'}
+        funnel = self.client.get('/api/metrics/insight-funnel', query).json()
+        self.assertEqual(
+            funnel['totals'],
+            {'shown': 2, 'opened': 1, 'useful': 1, 'dismissed': 1, 'open_rate': 0.5, 'useful_rate': 1.0, 'dismiss_rate': 0.5},
+        )
+        self.assertEqual(list(funnel['by_relation_type']), ['REPETITION'])
+
+        InsightFunnelCounter.objects.all().delete()
+        call_command('rebuild_insight_funnel', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/metrics/insight-funnel', query).json(), funnel)
+
+    def test_old_partitions_compact_into_rollups(self):
+        ids = [insight.id for insight in self.insights]
+        self._report_shown([ids[0], ids[0]])
+        old = timezone.now() - timedelta(days=250)
+        InsightEvent.objects.bulk_create(
+            InsightEvent(insight_id=ids[1], event_type='INSIGHT_OPENED', metadata={'note': 'x' * 2000}) for _ in range(200)
+        )
+        InsightEvent.objects.update(created_at=old)
+        InsightFunnelCounter.objects.update(day=old.date())
+        self._report_shown(ids)
+        query = {'user_id': self.session.user_id, 'start': '2000-01-01'}
+        funnel = self.client.get('/api/metrics/insight-funnel', query).json()
+        self.assertEqual(funnel['totals']['shown'], 4)
+
+        call_command('compact_insight_events', keep_months=6, stdout=StringIO())
+
+        month = old.date().replace(day=1)
+        self.assertEqual(
+            list(InsightEventRollup.objects.order_by('insight_id').values_list('insight_id', 'month', 'event_type', 'count')),
+            [(ids[0], month, 'INSIGHT_SHOWN', 2), (ids[1], month, 'INSIGHT_OPENED', 200)],
+        )
+        self.assertEqual(InsightEvent.objects.count(), 2)
+        call_command('rebuild_insight_funnel', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/metrics/insight-funnel', query).json(), funnel)
+
+    @override_settings(
+        MARS_INSIGHT_EVENT_BUFFER_ENABLED=True, MARS_INSIGHT_EVENT_BUFFER_SIZE=3, MARS_INSIGHT_EVENT_FLUSH_SECONDS=3600
+    )
+    def test_write_behind_buffer_flushes_at_size(self):
+        ids = [insight.id for insight in self.insights]
+        self.assertEqual(self._report_shown(ids).status_code, 202)
+        self.assertEqual((len(event_buffer), InsightEvent.objects.count()), (2, 0))
+
+        self._report_shown(ids[:1])
+        self.assertEqual((len(event_buffer), InsightEvent.objects.count()), (0, 3))
+
+
+class EventSpaceReclaimTests(WriterFixtures, TransactionTestCase):
+    def test_compaction_returns_pages_once_incremental_vacuum_is_enabled(self):
+        insight = Insight.objects.create(session=self.session, relation_type='REPETITION', reason_text='Seen before.')
+        InsightEvent.objects.bulk_create(
+            InsightEvent(insight=insight, event_type='INSIGHT_OPENED', metadata={'note': 'x' * 2000}) for _ in range(200)
+        )
+        InsightEvent.objects.update(created_at=timezone.now() - timedelta(days=250))
+
+        output = StringIO()
+        call_command('compact_insight_events', keep_months=6, enable_incremental_vacuum=True, stdout=output)
+
+        self.assertIn('Switched the database to incremental auto-vacuum.', output.getvalue())
+        self.assertRegex(output.getvalue(), r'Reclaimed [1-9]\d* database pages')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA freelist_count')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertFalse(InsightEvent.objects.exists())
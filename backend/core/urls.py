@@ -10,6 +10,11 @@ urlpatterns = [
     path("sessions", views.sessions_view, name="sessions"),
     path("sessions/<int:session_id>/complete", views.complete_session, name="complete-session"),
     path("documents/<int:document_id>/blocks", views.document_blocks, name="document-blocks"),
+    path("insight-jobs/<int:job_id>", views.insight_job_view, name="insight-job"),
     path("insights", views.insights_view, name="insights"),
     path("insights/<int:insight_id>/events", views.insight_event, name="insight-events"),
+    path("insight-events", views.insight_events_batch, name="insight-events-batch"),
+    path("sentiment/trend", views.sentiment_trend_view, name="sentiment-trend"),
+    path("metrics/candidate-cache", views.candidate_cache_metrics, name="candidate-cache-metrics"),
+    path("metrics/insight-funnel", views.insight_funnel_metrics, name="insight-funnel-metrics"),
 ]
@@ -0,0 +1,113 @@
+"""Hashed TF-IDF block vectors and random-hyperplane LSH for the vector similarity backend."""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import operator
+import random
+from array import array
+from functools import lru_cache
+from typing import Mapping
+
+from django.conf import settings
+
+VECTOR_SEED = 4099
+
+
+def vector_backend_enabled() -> bool:
+    """Return whether insights are scored by vector similarity instead of lexical overlap."""
+    return getattr(settings, "MARS_SIMILARITY_BACKEND", "lexical") == "vector"
+
+
+def vector_dimensions() -> int:
+    """Return the configured projected vector width (a multiple of 8, at most 512)."""
+    return getattr(settings, "MARS_VECTOR_DIMENSIONS", 128)
+
+
+def _features(token: str) -> list[tuple[str, float]]:
+    """Expand a token into itself plus boundary-marked character trigrams carrying as much norm as the token.
+
+    Trigrams let inflected or compound forms ("sorting", "sorted") land near each other.
+    """
+    marked = f"<{token}>"
+    trigrams = [marked[i : i + 3] for i in range(len(marked) - 2)]
+    return [(token, 1.0), *((f"#{gram}", 1.0 / math.sqrt(len(trigrams))) for gram in trigrams)]
+
+
+def _signs(feature: str, dims: int) -> int:
+    """Hash a feature to `dims` pseudo-random sign bits; this is the implicit projection matrix row."""
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=dims // 8, salt=VECTOR_SEED.to_bytes(16, "big"))
+    return int.from_bytes(digest.digest(), "big")
+
+
+def tfidf_vector(counts: Mapping[str, int], idf: Mapping[str, float], dims: int | None = None) -> array:
+    """Project sublinear TF-IDF weights of hashed features onto `dims` random +/-1 axes, L2-normalized.
+
+    Hashing each feature straight to a row of signs fuses the hashing trick with a sparse
+    random projection, so no vocabulary-sized matrix is ever materialized.
+    """
+    dims = dims or vector_dimensions()
+    totals = [0.0] * dims
+    for token, count in counts.items():
+        weight = (1.0 + math.log(count)) * idf.get(token, 1.0)
+        for feature, share in _features(token):
+            signs = _signs(feature, dims)
+            for axis in range(dims):
+                totals[axis] += weight * share if signs >> axis & 1 else -weight * share
+    norm = math.sqrt(sum(value * value for value in totals))
+    if not norm:
+        return array("f")
+    return array("f", (value / norm for value in totals))
+
+
+def cosine(a: array, b: array) -> float:
+    """Cosine similarity of two unit vectors; 0.0 when either is missing."""
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    return sum(map(operator.mul, a, b))
+
+
+def overlap_from_cosine(similarity: float) -> float:
+    """Map cosine similarity onto the Jaccard scale the relation thresholds are tuned for.
+
+    For two equal-sized token sets cosine is s/n while Jaccard is s/(2n - s), so
+    J = c / (2 - c); this keeps MIN_OVERLAP and the relation cut-offs meaningful.
+    """
+    if similarity <= 0:
+        return 0.0
+    return similarity / (2.0 - similarity)
+
+
+def hash_tables() -> int:
+    return getattr(settings, "MARS_VECTOR_HASH_TABLES", 32)
+
+
+def hash_bits() -> int:
+    return getattr(settings, "MARS_VECTOR_HASH_BITS", 12)
+
+
+@lru_cache(maxsize=8)
+def _hyperplanes(tables: int, bits: int, dims: int) -> tuple[tuple[float, ...], ...]:
+    """Return deterministic Gaussian hyperplanes shared by every process."""
+    rng = random.Random(VECTOR_SEED)
+    return tuple(tuple(rng.gauss(0.0, 1.0) for _ in range(dims)) for _ in range(tables * bits))
+
+
+def hyperplane_bucket_keys(vector: array) -> list[str]:
+    """Hash a vector into one bucket per table by the sides of `bits` random hyperplanes it falls on.
+
+    Two vectors at angle theta share a table's bucket with probability (1 - theta/pi) ** bits.
+    Keys are prefixed with "v" so they never collide with MinHash band keys.
+    """
+    if not vector:
+        return []
+    tables, bits = hash_tables(), hash_bits()
+    planes = _hyperplanes(tables, bits, len(vector))
+    keys = []
+    for table in range(tables):
+        code = 0
+        for plane in planes[table * bits : (table + 1) * bits]:
+            code = code << 1 | (sum(map(operator.mul, plane, vector)) >= 0)
+        keys.append(f"v{table}:{code:x}")
+    return keys
@@ -5,6 +5,7 @@ from __future__ import annotations
 from typing import Any
 
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import status
@@ -12,20 +13,38 @@ from rest_framework.decorators import api_view
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from .models import Block, Document, Insight, InsightEvent, Mode, Space, WritingSession
+from .cache import candidate_cache
+from .events import build_insight_events, event_buffer, event_buffer_enabled, record_insight_events
+from .funnel import count_events, insight_funnel
+from .jobs import enqueue_insight_job, run_scoped_insights
+from .models import Document, Insight, InsightEvent, InsightJob, Mode, Space, WritingSession
 from .serializers import (
     CreateDocumentSerializer,
     CreateInsightEventSerializer,
     CreateSessionSerializer,
     CreateSpaceSerializer,
     DocumentSerializer,
+    InsightEventBatchSerializer,
+    InsightFunnelQuerySerializer,
+    InsightJobSerializer,
     InsightSerializer,
     SaveBlocksSerializer,
+    SentimentTrendQuerySerializer,
     SpaceSerializer,
     UserSummarySerializer,
     WritingSessionSerializer,
 )
-from .services import generate_insights_for_session, segment_blocks, sentiment_score, update_journal_post_session_state
+from .sentiment import sentiment_trend
+from .services import (
+    BlockOperationError,
+    StaleRevisionError,
+    apply_block_operations,
+    content_hash,
+    record_save_receipt,
+    save_receipt,
+    sync_document_blocks,
+    update_journal_post_session_state,
+)
 
 
 def _demo_user() -> User:
@@ -142,7 +161,7 @@ def sessions_view(request: Request) -> Response:
 
 @api_view(["POST"])
 def complete_session(request: Request, session_id: int) -> Response:
-    """Finalize a writing session and generate mode-aware insights."""
+    """Finalize a writing session and queue mode-aware insight generation."""
     del request
     session = get_object_or_404(WritingSession, id=session_id)
 
@@ -154,13 +173,21 @@ def complete_session(request: Request, session_id: int) -> Response:
     if session.mode == Mode.JOURNAL:
         update_journal_post_session_state(session.user, session)
 
-    insights = generate_insights_for_session(session)
-    return Response({"session": WritingSessionSerializer(session).data, "insight_count": len(insights)})
+    job = enqueue_insight_job(session)
+    return Response(
+        {
+            "session": WritingSessionSerializer(session).data,
+            "insight_count": job.insight_count,
+            "insights_partial": job.partial,
+            "job_id": job.id,
+            "job_status": job.status,
+        }
+    )
 
 
 @api_view(["POST"])
 def document_blocks(request: Request, document_id: int) -> Response:
-    """Persist segmented document blocks and trigger insight generation when allowed."""
+    """Persist blocks from full text or paragraph operations, then score active blocks or queue insights; repeats replay."""
     serializer = SaveBlocksSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
     payload = serializer.validated_data
@@ -171,30 +198,42 @@ def document_blocks(request: Request, document_id: int) -> Response:
     if not document:
         return Response({"error": "session has no document"}, status=status.HTTP_400_BAD_REQUEST)
 
-    text = payload.get("text", "").strip()
     finalize = payload.get("finalize", False)
+    key = request.headers.get("Idempotency-Key", "")[:128]
+    text = payload.get("text", "").strip()
 
-    document.content = text
-    document.save(update_fields=["content", "updated_at"])
-
-    Block.objects.filter(document=document).delete()
-    parts = segment_blocks(text)
-
-    new_blocks: list[Block] = []
-    for idx, part in enumerate(parts):
-        block = Block.objects.create(
-            user=session.user,
-            space=session.space,
-            document=document,
-            order_index=idx,
-            text=part,
-            sentiment_score=round(sentiment_score(part), 4),
-        )
-        new_blocks.append(block)
-
-    insights: list[Insight] = []
-    if session.mode == Mode.LEARNING or finalize:
-        insights = generate_insights_for_session(session)
+    # Retries of a recent keyed save and identical autosaves get the earlier response back without any writes.
+    receipt = save_receipt(document, key) if key else None
+    if receipt and receipt["session"]["id"] == session.id:
+        return Response({**receipt, "revision": document.revision, "noop": True})
+    previous = document.last_save_response
+    if previous and previous["session"]["id"] == session.id:
+        if "operations" in payload:
+            unchanged = not payload["operations"] and payload["base_revision"] == document.revision
+        else:
+            unchanged = content_hash(text) == document.content_hash
+        if unchanged and not finalize and payload.get("active_blocks") == previous.get("active_blocks"):
+            return Response({**previous, "revision": document.revision, "noop": True})
+
+    try:
+        if "operations" in payload:
+            blocks = apply_block_operations(session, document, payload["operations"], payload["base_revision"])
+        else:
+            blocks = sync_document_blocks(session, document, text, payload.get("base_revision"))
+    except StaleRevisionError as exc:
+        return Response({"error": "stale revision", "revision": exc.revision}, status=status.HTTP_409_CONFLICT)
+    except BlockOperationError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # In-flow learning saves that name the blocks under the cursor score just those blocks
+    # inline; the full document pass waits for finalize. While another run of the session is
+    # in flight, the save joins the session's trailing full run instead.
+    job: InsightJob | None = None
+    active_insights: list[Insight] | None = None
+    if session.mode == Mode.LEARNING and not finalize and "active_blocks" in payload:
+        active_insights = run_scoped_insights(session, payload["active_blocks"])
+    if active_insights is None and (session.mode == Mode.LEARNING or finalize):
+        job = enqueue_insight_job(session)
 
     if finalize and session.is_active:
         session.is_active = False
@@ -203,14 +242,33 @@ def document_blocks(request: Request, document_id: int) -> Response:
         if session.mode == Mode.JOURNAL:
             update_journal_post_session_state(session.user, session)
 
-    return Response(
-        {
-            "document_id": document.id,
-            "block_count": len(new_blocks),
-            "insight_count": len(insights),
-            "session": WritingSessionSerializer(session).data,
-        }
-    )
+    body = {
+        "document_id": document.id,
+        "revision": document.revision,
+        "block_count": len(blocks),
+        "insight_count": job.insight_count if job else 0,
+        "insights_partial": job.partial if job else False,
+        "job_id": job.id if job else None,
+        "job_status": job.status if job else None,
+        "session": WritingSessionSerializer(session).data,
+        "noop": False,
+    }
+    if active_insights is not None:
+        body["active_blocks"] = payload["active_blocks"]
+        body["active_block_ids"] = [blocks[index].id for index in payload["active_blocks"] if index < len(blocks)]
+        body["insight_count"] = len(active_insights)
+        body["insights"] = InsightSerializer(active_insights, many=True).data
+    Document.objects.filter(id=document.id).update(last_save_response=body)
+    if key:
+        record_save_receipt(document, key, body)
+    return Response(body)
+
+
+@api_view(["GET"])
+def insight_job_view(_: Request, job_id: int) -> Response:
+    """Report the status and insight count of a queued insight generation job."""
+    job = get_object_or_404(InsightJob, id=job_id)
+    return Response({"job": InsightJobSerializer(job).data})
 
 
 @api_view(["GET"])
@@ -221,7 +279,8 @@ def insights_view(request: Request) -> Response:
         return Response({"error": "session_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
     insights = Insight.objects.filter(session_id=session_id).select_related("source_block", "current_block")
-    return Response({"insights": InsightSerializer(insights, many=True).data})
+    partial = WritingSession.objects.filter(id=session_id).values_list("insights_partial", flat=True).first()
+    return Response({"insights": InsightSerializer(insights, many=True).data, "partial": bool(partial)})
 
 
 @api_view(["POST"])
@@ -231,16 +290,74 @@ def insight_event(request: Request, insight_id: int) -> Response:
     serializer.is_valid(raise_exception=True)
     payload = serializer.validated_data
 
-    insight = get_object_or_404(Insight, id=insight_id)
+    insight = get_object_or_404(Insight.objects.select_related("session"), id=insight_id)
     session = None
     session_id = payload.get("session_id")
     if session_id:
         session = WritingSession.objects.filter(id=session_id).first()
 
-    event = InsightEvent.objects.create(
-        insight=insight,
-        session=session,
-        event_type=payload["event_type"],
-        metadata=payload.get("metadata") or {},
-    )
+    with transaction.atomic():
+        event = InsightEvent.objects.create(
+            insight=insight,
+            session=session,
+            event_type=payload["event_type"],
+            metadata=payload.get("metadata") or {},
+        )
+        count_events([(insight.session.space_id, insight.relation_type, insight.session.mode, event.event_type)])
     return Response({"event_id": event.id, "created_at": event.created_at.isoformat()}, status=status.HTTP_201_CREATED)
+
+
+@api_view(["POST"])
+def insight_events_batch(request: Request) -> Response:
+    """Record many insight events at once, inserting them in bulk or handing them to the write-behind buffer."""
+    serializer = InsightEventBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    items = serializer.validated_data["events"]
+
+    if event_buffer_enabled():
+        events, rejected = build_insight_events(items)
+        accepted = {event.insight_id for event in events}
+        event_buffer.add([item for item in items if item["insight_id"] in accepted])
+        return Response({"accepted": len(events), "rejected": rejected}, status=status.HTTP_202_ACCEPTED)
+
+    events, rejected = record_insight_events(items)
+    return Response({"accepted": len(events), "rejected": rejected}, status=status.HTTP_201_CREATED)
+
+
+@api_view(["GET"])
+def candidate_cache_metrics(_: Request) -> Response:
+    """Report this process's candidate cache hit/miss counters and occupancy."""
+    return Response({"candidate_cache": candidate_cache.stats()})
+
+
+@api_view(["GET"])
+def sentiment_trend_view(request: Request) -> Response:
+    """Return a user's sentiment trend over a date range from rollups, downsampled to `points`."""
+    serializer = SentimentTrendQuerySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    payload = serializer.validated_data
+
+    user = _resolve_user(payload)
+    period, points = sentiment_trend(
+        user.id, payload.get("space_id"), payload["start"], payload["end"], payload["points"]
+    )
+    return Response({"start": payload["start"], "end": payload["end"], "period": period, "points": points})
+
+
+@api_view(["GET"])
+def insight_funnel_metrics(request: Request) -> Response:
+    """Return shown/opened/useful/dismissed counts and rates for a user's insights from the funnel counters."""
+    serializer = InsightFunnelQuerySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    payload = serializer.validated_data
+
+    user = _resolve_user(payload)
+    funnel = insight_funnel(
+        user.id,
+        payload["start"],
+        payload["end"],
+        space_id=payload.get("space_id"),
+        mode=payload.get("mode"),
+        relation_type=payload.get("relation_type"),
+    )
+    return Response({"start": payload["start"], "end": payload["end"], **funnel})
@@ -0,0 +1,46 @@
+"""Integer token vocabulary and sorted-array set operations used for block features."""
+
+from __future__ import annotations
+
+from array import array
+from typing import Iterable, Sequence
+
+from .models import Term
+
+TOKEN_KEY_LENGTH = 64
+
+
+def term_ids(tokens: Iterable[str]) -> dict[str, int]:
+    """Map tokens to persistent vocabulary ids, registering unseen tokens in bulk."""
+    by_key: dict[str, str] = {token: token[:TOKEN_KEY_LENGTH] for token in tokens}
+    keys = set(by_key.values())
+    if not keys:
+        return {}
+    known = dict(Term.objects.filter(text__in=keys).values_list("text", "id"))
+    missing = keys.difference(known)
+    if missing:
+        Term.objects.bulk_create([Term(text=key) for key in missing], ignore_conflicts=True, batch_size=500)
+        known.update(Term.objects.filter(text__in=missing).values_list("text", "id"))
+    return {token: known[key] for token, key in by_key.items()}
+
+
+def sorted_id_array(ids: Iterable[int]) -> array:
+    """Return unique ids as a compact sorted uint32 array."""
+    return array("I", sorted(set(ids)))
+
+
+def intersection_size(a: Sequence, b: Sequence) -> int:
+    """Count common items of two sorted, duplicate-free sequences with a linear merge."""
+    i = j = shared = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        left, right = a[i], b[j]
+        if left == right:
+            shared += 1
+            i += 1
+            j += 1
+        elif left < right:
+            i += 1
+        else:
+            j += 1
+    return shared
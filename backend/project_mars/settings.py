@@ -127,3 +127,85 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
 }
+
+# Paragraphs longer than this are split into several blocks at sentence boundaries.
+MARS_MAX_BLOCK_CHARS = 2000
+
+# Insight candidate retrieval: "lsh" (approximate MinHash banding) or "index" (exact token postings).
+# The candidate cache below takes precedence: while it holds the space, candidates are the cached
+# blocks sharing a token with the current text (the "index" result) whatever this is set to.
+# Changing the MinHash settings requires `python manage.py reindex_blocks`.
+MARS_CANDIDATE_RETRIEVAL = "lsh"
+MARS_MINHASH_PERMUTATIONS = 32
+MARS_LSH_ROWS_PER_BAND = 1
+
+# Similarity backend for insights: "lexical" (token Jaccard) or "vector" (hashed TF-IDF vectors with
+# random-hyperplane LSH retrieval). Switching to "vector" requires `python manage.py reindex_blocks`.
+MARS_SIMILARITY_BACKEND = "lexical"
+MARS_VECTOR_DIMENSIONS = 128
+# 12 bits per table keep unrelated blocks (about 1 in 4096 per table) out of each other's buckets; the
+# extra tables restore recall for close paraphrases. Each current block compares against at most
+# MARS_VECTOR_MAX_CANDIDATES colliding blocks and keeps its MARS_VECTOR_TOP_K most similar.
+MARS_VECTOR_HASH_TABLES = 32
+MARS_VECTOR_HASH_BITS = 12
+MARS_VECTOR_MAX_CANDIDATES = 200
+MARS_VECTOR_TOP_K = 20
+
+# Width of the per-document Bloom filter used to skip documents that cannot reach the overlap threshold.
+MARS_DOCUMENT_FINGERPRINT_BITS = 8192
+
+# Per-process LRU of space candidate features, bounded by total cached token slots across spaces.
+# Cache hits bypass MARS_CANDIDATE_RETRIEVAL; disable the cache to get pure "lsh" retrieval. Spaces are
+# only loaded by runs without a time budget (queued jobs); time-bounded runs use retrieval on a miss.
+MARS_CANDIDATE_CACHE_ENABLED = True
+MARS_CANDIDATE_CACHE_MAX_TOKENS = 2_000_000
+# Directory for memory-mapped per-space feature files shared by all worker processes (None keeps
+# candidate features in each process's heap instead), e.g. BASE_DIR / "feature_store".
+MARS_FEATURE_STORE_DIR = None
+
+# Score the current x candidate grid across a process pool once it reaches this many pairs (0 disables).
+MARS_PARALLEL_SCORING_MIN_PAIRS = 250_000
+MARS_SCORING_WORKERS = None  # defaults to the CPU count
+
+# Persistent memo of pair outcomes keyed by paragraph content hashes (lexical backend only). Each row
+# remembers at most MAX_SOURCES evaluated sources (8 bytes each). `python manage.py prune_pair_memo`
+# bounds the table by row count and total evaluated-set bytes with least-recently-used eviction and a
+# time-to-live.
+MARS_PAIR_MEMO_ENABLED = True
+MARS_PAIR_MEMO_MAX_SOURCES = 10_000
+MARS_PAIR_MEMO_MAX_ENTRIES = 50_000
+MARS_PAIR_MEMO_MAX_BYTES = 256 * 1024 * 1024
+MARS_PAIR_MEMO_TTL_DAYS = 30
+
+# Insight generation runs through a database-backed queue drained by `python manage.py run_insight_worker`.
+# Eager mode runs each job inline in the request instead (useful for tests and single-process setups).
+MARS_INSIGHT_JOBS_EAGER = False
+# Each session runs at most one job at a time; a job still marked running after this long is
+# assumed to belong to a dead worker and is failed so the session can run again.
+MARS_INSIGHT_JOB_TIMEOUT_SECONDS = 300
+
+# Saves sent with an Idempotency-Key keep their response this long (and at most this many per
+# document), so a retry that arrives late, even after newer saves, is replayed instead of re-applied.
+MARS_SAVE_RECEIPT_TTL_HOURS = 24
+MARS_SAVE_RECEIPTS_PER_DOCUMENT = 50
+
+# NFR-1: learning-mode insights within 2 seconds. The budget bounds the in-flow runs that score active
+# blocks inside a save request (queued full runs always finish). It covers candidate retrieval and
+# scoring; scoring checks it between chunks of this many pairs and stops once it is spent.
+MARS_INSIGHT_TIME_BUDGET_SECONDS = 2.0
+MARS_ANYTIME_CHUNK_PAIRS = 4096
+
+# Raw sentiment snapshots older than this are deleted by `python manage.py compact_sentiment_snapshots`;
+# trends are served from rollups, which keep them.
+MARS_SENTIMENT_SNAPSHOT_RETENTION_DAYS = 365
+
+# Batched insight events are inserted in bulk per request. With the buffer enabled they are queued
+# in-process and written once this many are waiting or this many seconds after the first arrived.
+MARS_INSIGHT_EVENT_BUFFER_ENABLED = False
+MARS_INSIGHT_EVENT_BUFFER_SIZE = 200
+MARS_INSIGHT_EVENT_FLUSH_SECONDS = 2.0
+
+# Insight events are kept raw for the current month plus this many full months. Older monthly
+# partitions (logical created_at ranges of one table) are folded into per-insight rollups by
+# `python manage.py compact_insight_events`, which then returns the freed pages.
+MARS_INSIGHT_EVENT_RETENTION_MONTHS = 6
@@ -1,14 +1,20 @@
 'use client';
 
-import { useEffect, useMemo, useState } from 'react';
+import { useEffect, useMemo, useRef, useState } from 'react';
 import {
+  ApiError,
   bootstrap,
   completeSession,
   createDocument,
   createSession,
   fetchInsights,
+  paragraphIndexAt,
+  paragraphOperations,
   postInsightEvent,
+  postInsightEvents,
   saveBlocks,
+  splitParagraphs,
+  waitForInsightJob,
   type InsightRecord,
   type Mode,
   type SessionRecord,
@@ -39,6 +45,13 @@ export default function WorkspaceApp() {
   const [documentId, setDocumentId] = useState<number | null>(null);
   const [session, setSession] = useState<SessionRecord | null>(null);
   const [insights, setInsights] = useState<InsightRecord[]>([]);
+  // Server revision and paragraphs as last saved; null paragraphs forces the next save to send full text.
+  const [revision, setRevision] = useState<number | null>(null);
+  const [savedParagraphs, setSavedParagraphs] = useState<string[] | null>(null);
+  // Caret offset in the editor, used to scope in-flow learning evaluation to the paragraph being written.
+  const cursor = useRef(0);
+  // Insights already reported as shown, so repeated saves do not report them again.
+  const shownIds = useRef(new Set<number>());
 
   const canStart = userId !== null && spaceId !== null && !session;
   const canSave = documentId !== null && session?.is_active;
@@ -83,6 +96,8 @@ export default function WorkspaceApp() {
       });
 
       setDocumentId(document.id);
+      setRevision(document.revision);
+      setSavedParagraphs([]);
       setSession(createdSession);
       setInsights([]);
       setStatus(`${modeCopy.title} session started.`);
@@ -101,23 +116,66 @@ export default function WorkspaceApp() {
     setStatus(finalize ? 'Ending session and generating insights...' : 'Saving content...');
 
     try {
-      const saved = await saveBlocks(documentId, {
-        session_id: session.id,
-        text: content,
-        finalize,
-      });
+      const paragraphs = splitParagraphs(content);
+      const activeBlocks =
+        session.mode === 'LEARNING' && !finalize ? { active_blocks: [paragraphIndexAt(content, cursor.current)] } : {};
+      // One key per save attempt; a 409 leaves nothing stored under it, so the full-text fallback reuses it.
+      const idempotencyKey = crypto.randomUUID();
+      let saved: Awaited<ReturnType<typeof saveBlocks>> | null = null;
+      if (revision !== null && savedParagraphs !== null) {
+        try {
+          saved = await saveBlocks(
+            documentId,
+            {
+              session_id: session.id,
+              base_revision: revision,
+              operations: paragraphOperations(savedParagraphs, paragraphs),
+              finalize,
+              ...activeBlocks,
+            },
+            idempotencyKey
+          );
+        } catch (err) {
+          if (!(err instanceof ApiError && err.status === 409)) {
+            throw err;
+          }
+        }
+      }
+      if (!saved) {
+        saved = await saveBlocks(
+          documentId,
+          { session_id: session.id, text: content, finalize, ...activeBlocks },
+          idempotencyKey
+        );
+      }
+      setRevision(saved.revision);
+      // The server splits overlong paragraphs; fall back to full text until block and paragraph counts agree.
+      setSavedParagraphs(saved.block_count === paragraphs.length ? paragraphs : null);
 
       let latestSession = saved.session;
+      let jobId = saved.job_id;
 
       if (finalize && latestSession.is_active) {
         const completed = await completeSession(session.id);
         latestSession = completed.session;
+        jobId = completed.job_id;
       }
 
       setSession(latestSession);
 
+      // In-flow saves return the active paragraph's insights directly; otherwise wait for the queued pass.
+      if (saved.insights) {
+        showScopedInsights(saved.active_block_ids ?? [], saved.insights);
+        setStatus('Saved successfully.');
+        return;
+      }
+
+      if (jobId !== null) {
+        await waitForInsightJob(jobId);
+      }
+
       const insightResponse = await fetchInsights(session.id);
-      setInsights(insightResponse.insights);
+      showInsights(insightResponse.insights);
 
       setStatus(finalize ? `Session ended. ${insightResponse.insights.length} insights found.` : 'Saved successfully.');
     } catch (err) {
@@ -126,6 +184,35 @@ export default function WorkspaceApp() {
     }
   };
 
+  // Replace the whole panel, e.g. with the session's full insight list.
+  const showInsights = (next: InsightRecord[]) => {
+    setInsights(next);
+    reportShown(next);
+  };
+
+  // Replace only the insights of the rescored blocks; other paragraphs keep theirs.
+  const showScopedInsights = (blockIds: number[], scoped: InsightRecord[]) => {
+    const rescored = new Set([...blockIds, ...scoped.map((insight) => insight.current_block_id)]);
+    setInsights((prev) =>
+      [...prev.filter((insight) => !rescored.has(insight.current_block_id)), ...scoped].sort(
+        (a, b) => b.score - a.score
+      )
+    );
+    reportShown(scoped);
+  };
+
+  // Report the newly visible insights as shown in a single batch.
+  const reportShown = (next: InsightRecord[]) => {
+    const fresh = next.filter((insight) => !shownIds.current.has(insight.id));
+    if (!session || fresh.length === 0) {
+      return;
+    }
+    fresh.forEach((insight) => shownIds.current.add(insight.id));
+    postInsightEvents(
+      fresh.map((insight) => ({ insight_id: insight.id, event_type: 'INSIGHT_SHOWN', session_id: session.id }))
+    ).catch((err) => setError(err instanceof Error ? err.message : 'Failed to track insight events'));
+  };
+
   const trackInsight = async (insightId: number, eventType: string) => {
     if (!session) {
       return;
@@ -183,7 +270,13 @@ export default function WorkspaceApp() {
           <div className="mt-5">
             <textarea
               value={content}
-              onChange={(event) => setContent(event.target.value)}
+              onChange={(event) => {
+                setContent(event.target.value);
+                cursor.current = event.target.selectionStart;
+              }}
+              onSelect={(event) => {
+                cursor.current = event.currentTarget.selectionStart;
+              }}
               className="w-full h-[320px] rounded-xl border border-[#ddd] p-4 leading-relaxed outline-none focus:ring-2 focus:ring-[#d4d9ff]"
               placeholder="Start writing here. Use blank lines to create separate blocks."
             />
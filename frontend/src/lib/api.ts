@@ -10,6 +10,7 @@ export type DocumentRecord = {
   title: string;
   mode: Mode;
   space_id: number;
+  revision: number;
   updated_at: string;
 };
 
@@ -25,6 +26,7 @@ export type SessionRecord = {
 
 export type InsightRecord = {
   id: number;
+  current_block_id: number | null;
   relation_type: string;
   reason_text: string;
   score: number;
@@ -33,17 +35,49 @@ export type InsightRecord = {
   created_at: string;
 };
 
+export type InsightJobStatus = 'PENDING' | 'RUNNING' | 'DONE' | 'FAILED';
+
+export type InsightJobRecord = {
+  id: number;
+  session_id: number;
+  status: InsightJobStatus;
+  insight_count: number;
+  partial: boolean;
+  error: string;
+  created_at: string;
+  started_at: string | null;
+  finished_at: string | null;
+};
+
+export type BlockOperation =
+  | { op: 'insert' | 'replace'; index: number; text: string }
+  | { op: 'delete'; index: number };
+
+export type SaveBlocksPayload = { session_id: number; finalize?: boolean; active_blocks?: number[] } & (
+  | { text: string; base_revision?: number }
+  | { operations: BlockOperation[]; base_revision: number }
+);
+
+export class ApiError extends Error {
+  constructor(
+    message: string,
+    readonly status: number
+  ) {
+    super(message);
+  }
+}
+
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE ?? 'http://127.0.0.1:8000/api';
 
 async function request<T>(path: string, options?: RequestInit): Promise<T> {
   const response = await fetch(`${API_BASE}${path}`, {
-    headers: { 'Content-Type': 'application/json', ...(options?.headers ?? {}) },
     ...options,
+    headers: { 'Content-Type': 'application/json', ...(options?.headers ?? {}) },
   });
 
   if (!response.ok) {
     const text = await response.text();
-    throw new Error(text || `Request failed: ${response.status}`);
+    throw new ApiError(text || `Request failed: ${response.status}`, response.status);
   }
 
   return response.json() as Promise<T>;
@@ -69,25 +103,103 @@ export function createSession(payload: { user_id: number; space_id: number; docu
   });
 }
 
-export function saveBlocks(documentId: number, payload: { session_id: number; text: string; finalize?: boolean }) {
-  return request<{ document_id: number; block_count: number; insight_count: number; session: SessionRecord }>(
+/** Split text into trimmed, non-empty paragraphs the way the server segments blocks. */
+export function splitParagraphs(text: string): string[] {
+  return text
+    .split(/\n\s*\n/)
+    .map((part) => part.trim())
+    .filter(Boolean);
+}
+
+/** Index of the paragraph containing character `offset`, counting a cursor after a blank line as the next one. */
+export function paragraphIndexAt(text: string, offset: number): number {
+  return Math.max(0, splitParagraphs(`${text.slice(0, offset)}x`).length - 1);
+}
+
+/** Paragraph operations turning `previous` into `next`, covering only the changed middle span. */
+export function paragraphOperations(previous: string[], next: string[]): BlockOperation[] {
+  let start = 0;
+  while (start < previous.length && start < next.length && previous[start] === next[start]) {
+    start += 1;
+  }
+  let end = 0;
+  while (
+    end < previous.length - start &&
+    end < next.length - start &&
+    previous[previous.length - 1 - end] === next[next.length - 1 - end]
+  ) {
+    end += 1;
+  }
+
+  const removed = previous.length - start - end;
+  const added = next.slice(start, next.length - end);
+  const operations: BlockOperation[] = [];
+  added.slice(0, removed).forEach((text, offset) => operations.push({ op: 'replace', index: start + offset, text }));
+  added.slice(removed).forEach((text, offset) => operations.push({ op: 'insert', index: start + removed + offset, text }));
+  for (let count = removed - added.length; count > 0; count -= 1) {
+    operations.push({ op: 'delete', index: start + added.length });
+  }
+  return operations;
+}
+
+/** Save blocks; resending with the same `idempotencyKey` replays the first response instead of saving twice. */
+export function saveBlocks(documentId: number, payload: SaveBlocksPayload, idempotencyKey?: string) {
+  return request<{
+    document_id: number;
+    revision: number;
+    block_count: number;
+    insight_count: number;
+    insights_partial: boolean;
+    job_id: number | null;
+    job_status: InsightJobStatus | null;
+    session: SessionRecord;
+    active_blocks?: number[];
+    active_block_ids?: number[];
+    insights?: InsightRecord[];
+    noop: boolean;
+  }>(
     `/documents/${documentId}/blocks`,
     {
       method: 'POST',
       body: JSON.stringify(payload),
+      headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined,
     }
   );
 }
 
 export function completeSession(sessionId: number) {
-  return request<{ session: SessionRecord; insight_count: number }>(`/sessions/${sessionId}/complete`, {
-    method: 'POST',
-    body: '{}',
-  });
+  return request<{
+    session: SessionRecord;
+    insight_count: number;
+    insights_partial: boolean;
+    job_id: number;
+    job_status: InsightJobStatus;
+  }>(
+    `/sessions/${sessionId}/complete`,
+    {
+      method: 'POST',
+      body: '{}',
+    }
+  );
+}
+
+export function fetchInsightJob(jobId: number) {
+  return request<{ job: InsightJobRecord }>(`/insight-jobs/${jobId}`);
+}
+
+export async function waitForInsightJob(jobId: number, { intervalMs = 250, timeoutMs = 10000 } = {}) {
+  const deadline = Date.now() + timeoutMs;
+  for (;;) {
+    const { job } = await fetchInsightJob(jobId);
+    if (job.status === 'DONE' || job.status === 'FAILED' || Date.now() >= deadline) {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
 }
 
 export function fetchInsights(sessionId: number) {
-  return request<{ insights: InsightRecord[] }>(`/insights?session_id=${sessionId}`);
+  return request<{ insights: InsightRecord[]; partial: boolean }>(`/insights?session_id=${sessionId}`);
 }
 
 export function postInsightEvent(insightId: number, payload: { event_type: string; session_id?: number; metadata?: Record<string, unknown> }) {
@@ -96,3 +208,13 @@ export function postInsightEvent(insightId: number, payload: { event_type: strin
     body: JSON.stringify(payload),
   });
 }
+
+/** Record many insight events in one request; `rejected` lists insight ids that no longer exist. */
+export function postInsightEvents(
+  events: { insight_id: number; event_type: string; session_id?: number; metadata?: Record<string, unknown> }[]
+) {
+  return request<{ accepted: number; rejected: number[] }>('/insight-events', {
+    method: 'POST',
+    body: JSON.stringify({ events }),
+  });
+}